@@ -1,22 +1,22 @@
 import os
-from pathlib import Path
 
-import appdirs
-from flask import Flask
+from flask import Flask, g
 
-user_data_dir = Path(
-    appdirs.user_data_dir(appauthor="Niko Honue", appname="game_lists_site")
-)
-user_data_dir.mkdir(exist_ok=True, parents=True)
-database_dir = user_data_dir / "game_lists_site.db"
+from game_lists_site.models import user_data_dir
 
 
 # Application Factory function
 def create_app(test_config=None):
+    import game_lists_site.models as models
+
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY="dev",
-        DATABASE=str(database_dir),
+        # a playhouse.db_url url, or the path of an sqlite file
+        DATABASE=models.DATABASE,
+        DATABASE_MAX_CONNECTIONS=models.DATABASE_MAX_CONNECTIONS,
+        DATABASE_STALE_TIMEOUT=models.DATABASE_STALE_TIMEOUT,
+        DATABASE_POOL_TIMEOUT=models.DATABASE_POOL_TIMEOUT,
     )
 
     @app.context_processor
@@ -69,8 +69,37 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    models.init_db(app.config)
+
+    import game_lists_site.migrations as migrations
+
+    with models.db.connection_context():
+        schema_error = migrations.check_schema()
+    if schema_error:
+        print(schema_error)
+
+        @app.before_request
+        def schema_out_of_date():
+            # checked again until `flask db upgrade` ran, no restart needed
+            nonlocal schema_error
+            if schema_error:
+                with models.db.connection_context():
+                    schema_error = migrations.check_schema()
+            if schema_error:
+                return schema_error, 503
+
+    @app.before_request
+    def connect_db():
+        # False when the connection was already open, e.g. in a transaction
+        g.db_opened = models.db.connect(reuse_if_open=True)
+
+    @app.teardown_request
+    def close_db(exception):
+        # hands a pooled connection back to the pool
+        if g.pop("db_opened", False):
+            models.db.close()
+
     import game_lists_site.blueprints.auth as auth
-    import game_lists_site.models as models
 
     app.register_blueprint(auth.bp)
 
@@ -99,4 +128,13 @@ def create_app(test_config=None):
     app.register_blueprint(index.bp)
     app.add_url_rule("/", endpoint="index")
 
+    import game_lists_site.catalog as catalog
+    import game_lists_site.jobs as jobs
+    import game_lists_site.recommendations as recommendations
+
+    app.cli.add_command(migrations.db_cli)
+    app.cli.add_command(catalog.catalog_cli)
+    app.cli.add_command(recommendations.recommendations_cli)
+    app.cli.add_command(jobs.worker_command)
+
     return app
@@ -1,10 +1,19 @@
 import datetime as dt
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+from sklearn.decomposition import TruncatedSVD
 from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
 
+import game_lists_site.ann as ann
 from game_lists_site.models import Game, System
+from game_lists_site.recommendations import (
+    get_all_recommendations,
+    get_top_k,
+    save_recommendations,
+)
 from game_lists_site.utilities import (
     ParametersManager,
     days_delta,
@@ -13,29 +22,103 @@ from game_lists_site.utilities import (
     normalize_dict,
 )
 
+# dimensions of the vectors in the ann indexes
+ANN_DIMENSIONS = 128
+# memory for the similarities of one block of rows, each worker has one
+SIMILARITY_BLOCK_BYTES = 64 * 2**20
+
+
+def top_k_cosine(X, k: int, block_bytes=SIMILARITY_BLOCK_BYTES, max_workers=None):
+    """Yield (row, columns, scores) for every row of the matrix X.
+
+    columns are the other rows most cosine similar to row, at most k of them
+    and only positive scores, best first. Rows are compared a block at a
+    time and a thread pool computes the blocks (scipy and numpy release the
+    gil), one per cpu by default, so peak memory is about max_workers *
+    block_bytes for any number of rows instead of the rows² of a full
+    similarity matrix. X is a scipy sparse matrix or a numpy array.
+    """
+    max_workers = max_workers or os.cpu_count()
+    X = normalize(X.astype(np.float32))
+    sparse = hasattr(X, "tocsr")
+    if sparse:
+        X = X.tocsr()
+    XT = X.T.tocsr() if sparse else X.T
+    n = X.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return
+    # the sparse product, its dense copy and the argpartition indices take
+    # up to 32 bytes per pair
+    block_rows = max(1, block_bytes // (32 * n))
+
+    def top_k_of_block(start):
+        end = min(start + block_rows, n)
+        similarities = X[start:end] @ XT
+        if sparse:
+            similarities = similarities.toarray()
+        rows = np.arange(end - start)
+        similarities[rows, rows + start] = -1
+        columns = np.argpartition(similarities, n - k, axis=1)[:, n - k :]
+        scores = np.take_along_axis(similarities, columns, axis=1)
+        order = np.argsort(-scores, axis=1)
+        return (
+            np.take_along_axis(columns, order, axis=1),
+            np.take_along_axis(scores, order, axis=1),
+        )
+
+    starts = range(0, n, block_rows)
+    with ThreadPoolExecutor(max_workers) as executor:
+        for start, (columns, scores) in zip(
+            starts, executor.map(top_k_of_block, starts)
+        ):
+            for row, (row_columns, row_scores) in enumerate(zip(columns, scores)):
+                positive = row_scores > 0
+                yield start + row, row_columns[positive], row_scores[positive]
+
+
+def reduce_dimensions(X, dimensions: int = ANN_DIMENSIONS):
+    """Dense rows with about the cosine similarities of the rows of X.
+
+    Wide matrices are projected on their top singular vectors.
+    """
+    X = normalize(X)
+    if X.shape[1] <= dimensions:
+        return X.toarray() if hasattr(X, "toarray") else X
+    return TruncatedSVD(dimensions, random_state=0).fit_transform(X)
+
 
 def update_cbr_for_game(**current_parameters):
     p = ParametersManager("cbr_for_game", current_parameters, {"min_player_count": 10})
     system, _ = System.get_or_create(key="cbr_for_game")
     if days_delta(system.date_time) > 30 or p.is_diff_last_current():
         print("update cbr for game")
-        Game.update({Game.cbr: None}).execute()
-        games = Game.select(Game.id, Game.features).where(
-            (Game.features != None)
-            & (Game.player_count > p["min_player_count"])
+        games = list(
+            Game.select(Game.id, Game.features).where(
+                (Game.features != None)
+                & (Game.player_count > p["min_player_count"])
+            )
         )
+        if not games:
+            # e.g. a new install, the next run tries again
+            print("no games to compare")
+            return
         vectorizer = CountVectorizer()
         X = vectorizer.fit_transform([g.features for g in games])
-        csr = cosine_similarity(X, X)
-        for game_a, row in zip(games, csr):
-            game_a.cbr = dict(
-                sorted(
-                    [(game_b.id, value) for game_b, value in zip(games, row)],
-                    key=lambda x: x[1],
-                    reverse=True,
+        game_ids = np.array([g.id for g in games])
+        save_recommendations(
+            "game",
+            "cbr",
+            (
+                (
+                    int(game_ids[row]),
+                    dict(zip(game_ids[columns].tolist(), scores.tolist())),
                 )
-            )
-        Game.bulk_update(games, [Game.cbr])
+                for row, columns, scores in top_k_cosine(X, get_top_k())
+            ),
+            replace_all=True,
+        )
+        ann.save_index("game_cbr", game_ids, reduce_dimensions(X))
         system.date_time = dt.datetime.now()
         system.save()
 
@@ -45,19 +128,26 @@ def update_mbcf_for_games(**current_parameters):
     system, _ = System.get_or_create(key="mbcf_for_game")
     if (days_delta(system.date_time) > 30) or p.is_diff_last_current():
         print("update mbcf for game")
-        Game.update({Game.mbcf: None}).execute()
         game_ids, _, game_vecs = get_game_vecs(p['min_player_count'], p['min_game_count'])
-        games = [Game.get_by_id(game_id) for game_id in game_ids]
-        game_vecs = np.corrcoef(game_vecs)
-        for game_a, row in zip(games, game_vecs):
-            game_a.mbcf = dict(
-                sorted(
-                    [(game_id_b, value) for game_id_b, value in zip(game_ids, row)],
-                    key=lambda x: x[1],
-                    reverse=True,
+        if not len(game_ids):
+            print("no games to compare")
+            return
+        # the cosine of centered rows is their correlation
+        game_vecs = game_vecs - game_vecs.mean(axis=1, keepdims=True)
+        game_ids = np.array(game_ids)
+        save_recommendations(
+            "game",
+            "mbcf",
+            (
+                (
+                    int(game_ids[row]),
+                    dict(zip(game_ids[columns].tolist(), scores.tolist())),
                 )
-            )
-        Game.bulk_update(games, [Game.mbcf])
+                for row, columns, scores in top_k_cosine(game_vecs, get_top_k())
+            ),
+            replace_all=True,
+        )
+        ann.save_index("game_mbcf", game_ids, reduce_dimensions(game_vecs))
         system.date_time = dt.datetime.now()
         system.save()
 
@@ -70,19 +160,24 @@ def update_hr_for_games(**current_parameters):
         or p.is_diff_last_current()
     ):
         print("update hr for game")
-        Game.update({Game.hr: None}).execute()
-        games = Game.select(Game.id, Game.cbr, Game.mbcf)
-        for game in games:
-            cbr_result = game.cbr
-            mbcf_result = game.mbcf
-            game.hr = merge_dicts(
+        cbr_results = get_all_recommendations("game", "cbr")
+        mbcf_results = get_all_recommendations("game", "mbcf")
+        hr_results = {}
+        for game_id in cbr_results.keys() | mbcf_results.keys():
+            cbr_result = cbr_results.get(game_id)
+            mbcf_result = mbcf_results.get(game_id)
+            hr_results[game_id] = merge_dicts(
                 [
                     normalize_dict(cbr_result, p['cbr_coef']) if cbr_result else [],
                     normalize_dict(mbcf_result, p['mbcf_coef']) if mbcf_result else [],
                 ]
             )
-            if not game.hr:
-                game.hr = None
-        Game.bulk_update(games, [Game.hr])
+        save_recommendations("game", "hr", hr_results, replace_all=True)
         system.date_time = dt.datetime.now()
-        system.save()
\ No newline at end of file
+        system.save()
+
+
+def update_recommendations_for_games():
+    update_cbr_for_game()
+    update_mbcf_for_games()
+    update_hr_for_games()
@@ -9,8 +9,17 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from game_lists_site.algorithms.game import update_cbr_for_game
+import game_lists_site.ann as ann
+from game_lists_site.algorithms.game import reduce_dimensions, update_cbr_for_game
 from game_lists_site.models import Game, System, User, UserGame, db, user_data_dir
+from game_lists_site.recommendations import (
+    delete_recommendations,
+    get_all_recommendations,
+    get_recommendations,
+    get_top_k,
+    has_recommendations,
+    save_recommendations,
+)
 from game_lists_site.utilities import (
     ParametersManager,
     days_delta,
@@ -20,7 +29,6 @@ from game_lists_site.utilities import (
     merge_dicts,
     normalize_dict,
     get_game_vecs,
-    slice_dict,
 )
 
 
@@ -36,10 +44,10 @@ def update_cbr_for_user(user, **current_parameters):
     )
     if p.is_diff_last_current():
         q = User.update({User.cbr_update_time:None}).where(User.cbr_update_time != None).execute()
-    if days_delta(User.get_by_id(user.id).cbr_update_time) >= 1 or not user.cbr:
+    if days_delta(User.get_by_id(user.id).cbr_update_time) >= 1 or not has_recommendations("user", user.id, "cbr"):
         # print(f'update cbr for "{user.username}"')
         update_cbr_for_game(min_player_count=p["min_player_count"])
-        user.cbr = None
+        delete_recommendations("user", "cbr", user.id)
         last_played = np.quantile(
             [
                 ug.last_played
@@ -50,7 +58,7 @@ def update_cbr_for_user(user, **current_parameters):
             0.05,
         )
         played_games = (
-            Game.select(Game.id, Game.cbr, UserGame.score)
+            Game.select(Game.id, UserGame.score)
             .join(UserGame)
             .where(
                 (UserGame.user == user)
@@ -58,7 +66,15 @@ def update_cbr_for_user(user, **current_parameters):
                 & (UserGame.last_played >= last_played)
             )
         )
-        games_with_score = played_games.where((UserGame.score > 0) & (Game.cbr != None))
+        cbr_results = get_all_recommendations(
+            "game",
+            "cbr",
+            [game.id for game in played_games],
+            p["cbr_for_game_result_count"],
+        )
+        games_with_score = played_games.where(
+            (UserGame.score > 0) & Game.id.in_(list(cbr_results))
+        )
         # use normalized playtimes if not enough games with score
         if games_with_score.count() < 8:
             users_games_playtimes = get_normalized_playtimes(
@@ -67,25 +83,28 @@ def update_cbr_for_user(user, **current_parameters):
                 zscore=False,
             )
             user_games_playtimes = (
-                users_games_playtimes[str(user.id)]
-                if str(user.id) in users_games_playtimes
+                users_games_playtimes[user.id]
+                if user.id in users_games_playtimes
                 else []
             )
             result = []
             for game in played_games:
-                if str(game.id) in user_games_playtimes.keys():
-                    if game.cbr:
+                if game.id in user_games_playtimes.keys():
+                    if game.id in cbr_results:
                         result.append(
                             {
                                 "id": game.id,
-                                "cbr": game.cbr,
-                                "score": user_games_playtimes[str(game.id)],
+                                "cbr": cbr_results[game.id],
+                                "score": user_games_playtimes[game.id],
                             }
                         )
                 games_with_score = result
         # else use score
         else:
-            games_with_score = games_with_score.dicts()
+            games_with_score = [
+                {**game, "cbr": cbr_results[game["id"]]}
+                for game in games_with_score.dicts()
+            ]
         games_with_score = sorted(
             games_with_score, key=lambda x: x["score"], reverse=True
         )[: p["max_game"]]
@@ -96,20 +115,20 @@ def update_cbr_for_user(user, **current_parameters):
                 {
                     key: value * game_a_dict["score"]
                     for key, value in list(game_a_dict["cbr"].items())[
-                        1 : p["cbr_for_game_result_count"] + 1
+                        : p["cbr_for_game_result_count"]
                     ]
                 }
             )
         result = {
-            str(game.id): value
+            game.id: value
             for game, value in get_readable_result_for_games(
                 merge_dicts(result)
             ).items()
             if game not in played_games and game.rating >= 7
         }
-        user.cbr = result
+        save_recommendations("user", "cbr", {user.id: result})
         user.cbr_update_time = dt.datetime.now()
-        user.save()
+        user.save(only=[User.cbr_update_time])
 
 
 def update_similar_users(**current_parameters):
@@ -124,21 +143,24 @@ def update_similar_users(**current_parameters):
         _, user_ids, game_vecs = get_game_vecs(
             p["min_player_count"], p["min_game_count"]
         )
+        if not len(user_ids):
+            print("no users to compare")
+            return
         user_vecs = np.flip(np.rot90(game_vecs), 0)
-        users = [User.get_by_id(user_id) for user_id in user_ids]
-        user_vecs = np.corrcoef(user_vecs)
-        for user_a, row in zip(users, user_vecs):
-            user_a.similar_users = dict(
-                sorted(
-                    [
-                        (str(user_id_b), value)
-                        for user_id_b, value in zip(user_ids, row)
-                    ],
-                    key=lambda x: x[1],
-                    reverse=True,
-                )
-            )
-        User.bulk_update(users, [User.similar_users])
+        # neighbours from an ann index instead of a users × users
+        # correlation matrix, centering makes the cosine a correlation
+        index = ann.save_index(
+            "user_coplay",
+            user_ids,
+            reduce_dimensions(user_vecs - user_vecs.mean(axis=1, keepdims=True)),
+        )
+        top_k = get_top_k()
+        save_recommendations(
+            "user",
+            "similar_users",
+            ((user_id, index.similar(user_id, top_k)) for user_id in user_ids),
+            replace_all=True,
+        )
         system.date_time = dt.datetime.now()
         system.save()
 
@@ -156,9 +178,12 @@ def update_mbcf_for_user(user, **current_parameters):
     )
     if p.is_diff_last_current():
         q = User.update({User.mbcf_update_time:None}).where(User.mbcf_update_time != None).execute()
-    if days_delta(User.get_by_id(user.id).mbcf_update_time) >= 1 or not user.mbcf:
+    if days_delta(User.get_by_id(user.id).mbcf_update_time) >= 1 or not has_recommendations("user", user.id, "mbcf"):
         update_similar_users(min_game_count=p["min_game_count"], min_player_count=p["min_player_count"])
-        if not user.similar_users:
+        similar_users = get_recommendations(
+            "user", user.id, "similar_users", p["sim_user_count"]
+        )
+        if not similar_users:
             print("Fuck")
             return
         last_played = np.quantile(
@@ -171,7 +196,7 @@ def update_mbcf_for_user(user, **current_parameters):
             0.05,
         )
         played_games = (
-            Game.select(Game.id, Game.cbr, UserGame.score)
+            Game.select(Game.id, UserGame.score)
             .join(UserGame)
             .where(
                 (UserGame.user == user)
@@ -183,7 +208,6 @@ def update_mbcf_for_user(user, **current_parameters):
             True, min_player_count=p["min_player_count"], zscore=False
         )
         result = []
-        similar_users = slice_dict(user.similar_users, 1, p["sim_user_count"] + 1)
         for user_id, coef in similar_users.items():
             if user_id in normalized_playtimes:
                 result.append(
@@ -196,15 +220,16 @@ def update_mbcf_for_user(user, **current_parameters):
                         )[: int(p["max_game"])]
                     }
                 )
-        user.mbcf = {
-            str(game.id): value
+        result = {
+            game.id: value
             for game, value in get_readable_result_for_games(
                 merge_dicts(result)
             ).items()
             if game not in played_games and game.rating >= 7
         }
+        save_recommendations("user", "mbcf", {user.id: result})
         user.mbcf_update_time = dt.datetime.now()
-        user.save()
+        user.save(only=[User.mbcf_update_time])
 
 
 class MF(nn.Module):
@@ -228,7 +253,7 @@ def update_mobcf(**current_parameters):
     system, _ = System.get_or_create(key="mobcf_for_user")
     if days_delta(system.date_time) >= 1 or p.is_diff_last_current():
         print("update mobcf")
-        User.update({User.mobcf: None}).execute()
+        delete_recommendations("user", "mobcf")
         normalized_playtimes = get_normalized_playtimes(
             True, min_player_count=p["min_player_count"], zscore=p["zscore"]
         )
@@ -309,7 +334,7 @@ def update_mobcf_for_user(user, **current_parameters):
     )
     if p.is_diff_last_current():
         q = User.update({User.mobcf_update_time:None}).where(User.mobcf_update_time != None).execute()
-    if days_delta(User.get_by_id(user.id).mobcf_update_time) >= 1 or not user.mobcf:
+    if days_delta(User.get_by_id(user.id).mobcf_update_time) >= 1 or not has_recommendations("user", user.id, "mobcf"):
         update_mobcf(
             min_player_count=p["min_player_count"],
             zscore=p["zscore"],
@@ -357,15 +382,16 @@ def update_mobcf_for_user(user, **current_parameters):
                     result.items(), key=lambda item: item[1], reverse=True
                 )
             }
-            user.mobcf = {
+            result = {
                 game.id: score
                 for game, score in games.items()
                 if game not in played_games
                 and game.player_count > p["min_player_count"]
                 and game.rating >= 7
             }
+            save_recommendations("user", "mobcf", {user.id: result})
             user.mobcf_update_time = dt.datetime.now()
-            user.save()
+            user.save(only=[User.mobcf_update_time])
 
 
 def update_hr_for_user(user, **current_parameters):
@@ -376,17 +402,28 @@ def update_hr_for_user(user, **current_parameters):
     )
     if p.is_diff_last_current():
         q = User.update({User.hr_update_time:None}).where(User.hr_update_time != None).execute()
-    if days_delta(User.get_by_id(user.id).hr_update_time) >= 1 or not user.hr:
+    if days_delta(User.get_by_id(user.id).hr_update_time) >= 1 or not has_recommendations("user", user.id, "hr"):
         print(f"update hr for {user.username}")
         update_cbr_for_user(user)
         update_mbcf_for_user(user)
         update_mobcf_for_user(user)
-        user.hr = merge_dicts(
+        cbr = get_recommendations("user", user.id, "cbr")
+        mbcf = get_recommendations("user", user.id, "mbcf")
+        mobcf = get_recommendations("user", user.id, "mobcf")
+        result = merge_dicts(
             [
-                normalize_dict(user.cbr, p["cbr_coef"]) if user.cbr else [],
-                normalize_dict(user.mbcf, p["mbcf_coef"]) if user.mbcf else [],
-                normalize_dict(user.mobcf, p["mobcf_coef"]) if user.mobcf else [],
+                normalize_dict(cbr, p["cbr_coef"]) if cbr else [],
+                normalize_dict(mbcf, p["mbcf_coef"]) if mbcf else [],
+                normalize_dict(mobcf, p["mobcf_coef"]) if mobcf else [],
             ]
         )
+        save_recommendations("user", "hr", {user.id: result})
         user.hr_update_time = dt.datetime.now()
-        user.save()
+        user.save(only=[User.hr_update_time])
+
+
+def update_recommendations_for_user(user):
+    update_cbr_for_user(user)
+    update_mbcf_for_user(user)
+    update_mobcf_for_user(user)
+    update_hr_for_user(user)
@@ -0,0 +1,193 @@
+"""Approximate nearest neighbours of game and user vectors.
+
+An AnnIndex is an inverted file: spherical k-means splits the L2-normalized
+vectors into lists around centroids, stored one after the other. A query
+scans the `probes` lists whose centroids are the most similar to it and
+ranks what it finds by exact cosine, more probes give a better recall for a
+slower query.
+
+Indexes are built by the algorithms and saved as .npy files under
+ANN_INDEX_DIR, which web workers memory-map, so they share one copy in the
+page cache and pick up a new build on their next query. Only numpy is
+needed to query.
+"""
+
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from flask import current_app, has_app_context
+
+from game_lists_site.models import user_data_dir
+
+PROBES = 64
+# lists per square root of the vector count
+LIST_FACTOR = 4
+KMEANS_ITERATIONS = 10
+BLOCK_ROWS = 8192
+# builds kept on disk, readers that saw the previous pointer can still load
+# the previous build
+KEEP_BUILDS = 2
+ARRAYS = ("ids", "vectors", "centroids", "offsets", "sorted_ids", "rows")
+
+
+class AnnIndex:
+    def __init__(self, ids, vectors, centroids, offsets, sorted_ids, rows):
+        # vectors[i] is the normalized vector of ids[i], list l is the rows
+        # offsets[l]:offsets[l + 1]
+        self.ids = ids
+        self.vectors = vectors
+        self.centroids = centroids
+        self.offsets = offsets
+        # ids sorted and their rows, to find the vector of an id
+        self.sorted_ids = sorted_ids
+        self.rows = rows
+
+    @classmethod
+    def build(cls, ids, vectors, lists: int = None, seed=0):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        if lists is None:
+            lists = int(LIST_FACTOR * np.sqrt(len(ids)))
+        lists = max(1, min(lists, len(ids)))
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(ids), lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignments = nearest_centroids(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            # lists that lost all their vectors start over from a random one
+            empty = np.bincount(assignments, minlength=lists) == 0
+            sums[empty] = vectors[rng.choice(len(ids), empty.sum())]
+            centroids = normalize(sums)
+        assignments = nearest_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        ids, vectors = ids[order], vectors[order]
+        offsets = np.searchsorted(assignments[order], np.arange(lists + 1))
+        rows = np.argsort(ids).astype(np.int32)
+        return cls(ids, vectors, centroids, offsets, ids[rows], rows)
+
+    def query(self, vector, k: int = 10, probes: int = PROBES, exclude=None):
+        """{id: score} of the k vectors most cosine similar to vector."""
+        vector = normalize(np.asarray(vector, dtype=np.float32)[None])[0]
+        lists = self.centroids @ vector
+        if len(lists) > probes:
+            lists = np.argpartition(lists, -probes)[-probes:]
+        else:
+            lists = np.arange(len(lists))
+        starts = self.offsets[lists]
+        lengths = self.offsets[lists + 1] - starts
+        # the rows of every list, concatenated
+        rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        rows += np.arange(len(rows))
+        if exclude is not None:
+            rows = rows[self.ids[rows] != exclude]
+        scores = self.vectors[rows] @ vector
+        if len(rows) > k:
+            best = np.argpartition(scores, -k)[-k:]
+            rows, scores = rows[best], scores[best]
+        best = np.argsort(-scores)
+        return dict(zip(self.ids[rows[best]].tolist(), scores[best].tolist()))
+
+    def similar(self, id: int, k: int = 10, probes: int = PROBES):
+        """{id: score} of the k vectors most similar to the one of id."""
+        position = np.searchsorted(self.sorted_ids, id)
+        if position == len(self.ids) or self.sorted_ids[position] != id:
+            return {}
+        return self.query(self.vectors[self.rows[position]], k, probes, exclude=id)
+
+    def save(self, path):
+        path.mkdir(parents=True)
+        for name in ARRAYS:
+            np.save(path / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        return cls(
+            *(np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in ARRAYS)
+        )
+
+
+def nearest_centroids(vectors, centroids):
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + BLOCK_ROWS] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), BLOCK_ROWS)
+        ]
+    )
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def get_index_dir():
+    if has_app_context():
+        return Path(current_app.config.get("ANN_INDEX_DIR", user_data_dir / "ann"))
+    return user_data_dir / "ann"
+
+
+def save_index(name: str, ids, vectors, **kwargs):
+    """Build an index of vectors and make it the current one of name.
+
+    Every build gets its own directory and the `<name>.current` file points
+    to the latest, so readers never see half written arrays. The builds
+    before the last KEEP_BUILDS are removed. Without vectors, e.g. on a new
+    install, name has no current index and None is returned.
+    """
+    index_dir = get_index_dir()
+    if not len(ids):
+        (index_dir / f"{name}.current").unlink(missing_ok=True)
+        print(f"no vectors for the {name} index")
+        return None
+    index = AnnIndex.build(ids, vectors, **kwargs)
+    build = f"{name}.{time.time_ns()}"
+    index.save(index_dir / build)
+    pointer = index_dir / f"{name}.current"
+    pointer.with_suffix(".tmp").write_text(build)
+    os.replace(pointer.with_suffix(".tmp"), pointer)
+    builds = sorted(
+        index_dir.glob(f"{name}.*[0-9]"), key=lambda path: int(path.suffix[1:])
+    )
+    for old in builds[:-KEEP_BUILDS]:
+        # windows can't remove the files a worker still has mapped, the
+        # next build tries again
+        shutil.rmtree(old, ignore_errors=True)
+    print(f"saved {name} index of {len(index.ids)} vectors")
+    return index
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_index(name: str):
+    """The current index of name, memory-mapped, or None if none was built."""
+    # a build can be removed between reading the pointer and loading it, by
+    # builds that came after, the pointer then names a newer one
+    for attempt in range(2):
+        try:
+            return load_current(name)
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+
+def load_current(name: str):
+    try:
+        build = (get_index_dir() / f"{name}.current").read_text()
+    except FileNotFoundError:
+        return None
+    cached = _indexes.get(name)
+    if cached and cached[0] == build:
+        return cached[1]
+    with _lock:
+        cached = _indexes.get(name)
+        if not cached or cached[0] != build:
+            cached = build, AnnIndex.load(get_index_dir() / build)
+            _indexes[name] = cached
+    return cached[1]
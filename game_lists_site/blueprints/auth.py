@@ -93,7 +93,7 @@ def load_logged_in_user():
     if user_id is None:
         g.user = None
     else:
-        g.user = User.get_or_none(id=user_id)
+        g.user = User.slim().where(User.id == user_id).first()
 
 
 @bp.route("/logout")
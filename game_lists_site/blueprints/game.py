@@ -1,11 +1,7 @@
 from bs4 import BeautifulSoup
-from flask import Blueprint, abort, render_template
+from flask import Blueprint, abort, redirect, render_template, url_for
 
-from game_lists_site.algorithms.game import (
-    update_cbr_for_game,
-    update_hr_for_games,
-    update_mbcf_for_games,
-)
+import game_lists_site.utils.steam as steam
 from game_lists_site.models import (
     Developer,
     Game,
@@ -15,16 +11,26 @@ from game_lists_site.models import (
     Genre,
     Tag,
 )
-from game_lists_site.utilities import get_readable_result_for_games, update_game
+from game_lists_site.recommendations import get_recommended_games, get_similar_games
+from game_lists_site.utilities import update_game
 
 bp = Blueprint("game", __name__, url_prefix="/game")
 
 
 @bp.route("<game_id>/<game_name>")
 def game(game_id, game_name):
-    if not update_game(game_id):
+    if not game_id.isdigit():
+        abort(404)
+    try:
+        game = update_game(game_id)
+    except steam.SteamError:
+        abort(503)
+    if not game:
         abort(404)
-    game = Game.get_by_id(game_id)
+    if game.id != int(game_id):
+        # steam redirects this appid to another game
+        return redirect(url_for("game.game", game_id=game.id, game_name=game.name))
+    game = Game.get_by_id(game.id)
     developers = [
         d.name
         for d in Developer.select(Developer.name)
@@ -38,19 +44,23 @@ def game(game_id, game_name):
     tags = [
         t.name for t in Tag.select(Tag.name).join(GameTag).where(GameTag.game == game)
     ]
-    short_description = BeautifulSoup(game.description, "html.parser").get_text(
+    description = game.get_description() or ""
+    short_description = BeautifulSoup(description, "html.parser").get_text(
         separator=" "
     )
     short_description = short_description[: min(500, len(short_description))] if short_description else ""
-    update_cbr_for_game()
-    update_mbcf_for_games()
-    update_hr_for_games()
-    cbr_result = get_readable_result_for_games(game.cbr, 9)
-    mbcf_result = get_readable_result_for_games(game.mbcf, 9)
-    hr_result = get_readable_result_for_games(game.hr, 9)
+    # the ann indexes are approximate, only for games without an exact list
+    cbr_result = get_recommended_games("game", game.id, "cbr", 9)
+    if not cbr_result:
+        cbr_result = get_similar_games("game_cbr", game.id)
+    mbcf_result = get_recommended_games("game", game.id, "mbcf", 9)
+    if not mbcf_result:
+        mbcf_result = get_similar_games("game_mbcf", game.id)
+    hr_result = get_recommended_games("game", game.id, "hr", 9)
     return render_template(
         "game.html",
         game=game,
+        description=description,
         developers=developers,
         genres=genres,
         tags=tags,
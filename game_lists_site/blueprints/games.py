@@ -3,14 +3,13 @@ from flask import Blueprint, jsonify, render_template, request
 from peewee import fn
 
 from game_lists_site.models import Game, GameDeveloper, GameGenre, GameTag, UserGame
-from game_lists_site.utils.utils import get_game_stats
 
 bp = Blueprint("games", __name__, url_prefix="/games")
 
 
 @bp.route("/")
 def games():
-    games = list(
+    games = (
         Game.select(
             Game.id,
             Game.player_count,
@@ -22,10 +21,11 @@ def games():
             Game.min_playtime,
             Game.playtime,
             Game.image_url,
-        ).where(Game.player_count > 0)
+        )
+        .where(Game.player_count > 0)
+        .order_by(Game.score.desc(), Game.player_count.desc())
+        .limit(40)
     )
-    games = sorted(games, key=lambda x: x.player_count, reverse=True)
-    games = sorted(games, key=lambda x: x.score, reverse=True)[:40]
     return render_template("games/games.html", games=games)
 
 
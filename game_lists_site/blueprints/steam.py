@@ -2,6 +2,7 @@ from flask import Blueprint, abort, jsonify
 from flask_peewee.utils import get_object_or_404
 
 import game_lists_site.utils.steam as steam
+from game_lists_site.jobs import get_last_job
 from game_lists_site.models import User
 
 bp = Blueprint("steam", __name__, url_prefix="/steam")
@@ -28,7 +29,7 @@ def get_profile_app(user_id: int):
 @bp.route("check-profile/<profile_id>")
 def check_profile(profile_id: int):
     print(profile_id)
-    user = get_object_or_404(User, User.id == profile_id)
+    user = get_object_or_404(User.slim(), User.id == profile_id)
     if user.last_games_update_time:
         return user.username
     else:
@@ -37,5 +38,22 @@ def check_profile(profile_id: int):
 
 @bp.route("check-games/<user_id>")
 def check_games(user_id: int):
-    user = get_object_or_404(User, User.id == user_id)
+    user = get_object_or_404(User.slim(), User.id == user_id)
     return str(user.last_games_update_time != None)
+
+
+@bp.route("sync-status/<user_id>")
+def sync_status(user_id: int):
+    user = get_object_or_404(
+        User.select(User.id, User.last_games_update_time), User.id == user_id
+    )
+    job = get_last_job("sync_library", user)
+    return jsonify(
+        {
+            "synced": user.last_games_update_time != None,
+            "status": job.status if job else None,
+            "stage": job.stage if job else None,
+            "progress": job.progress if job else 0,
+            "total": job.total if job else None,
+        }
+    )
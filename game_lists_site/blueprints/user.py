@@ -1,39 +1,25 @@
-import datetime as dt
 import json
 
 from flask import Blueprint, jsonify, render_template, request
 from flask_peewee.utils import get_object_or_404
 
-import game_lists_site.utils.steam as steam
-from game_lists_site.algorithms.user import (
-    update_cbr_for_user,
-    update_hr_for_user,
-    update_mbcf_for_user,
-    update_mobcf_for_user,
-)
+from game_lists_site.jobs import enqueue, get_last_job
 from game_lists_site.models import Game, User, UserGame
-from game_lists_site.utilities import (
-    days_delta,
-    get_readable_result_for_games,
-    update_game,
-    update_game_score_stats,
-    update_game_stats,
-    update_normalization,
+from game_lists_site.recommendations import (
+    get_recommended_games,
+    user_recommendations_stale,
 )
+from game_lists_site.utilities import days_delta, update_game_score_stats
 
 bp = Blueprint("user", __name__, url_prefix="/user")
 
 
 @bp.route("/<username>")
 def user(username: str):
-    user = get_object_or_404(User, User.username == username)
+    user = get_object_or_404(User.slim(), User.username == username)
     if days_delta(user.last_update_time) >= 1:
-        player_summary = steam.get_player_summary(user.id)
-        if player_summary:
-            user.avatar_url = player_summary["avatarfull"]
-            user.profile_url = player_summary["profileurl"]
-            user.last_update_time = dt.datetime.now()
-            user.save()
+        # the worker refreshes every stale user, 100 per steam request
+        enqueue("refresh_player_summaries")
     return render_template("user/user.html", user=user)
 
 
@@ -43,7 +29,7 @@ def games(username: str):
         data = json.loads(request.data.decode("utf-8"))
         if "id" in data and "score" in data:
             id = int(data["id"])
-            user = get_object_or_404(User, User.username == username)
+            user = get_object_or_404(User.slim(), User.username == username)
             game = get_object_or_404(Game, Game.id == id)
             score = max(min(int(data["score"]), 10), 0) if data["score"] else 0
             ug = get_object_or_404(
@@ -53,52 +39,35 @@ def games(username: str):
             ug.save()
             update_game_score_stats(ug.game)
             return jsonify({"id": id, "score": score})
-    user = get_object_or_404(User, User.username == username)
+    user = get_object_or_404(User.slim(), User.username == username)
     if days_delta(user.last_games_update_time) >= 1:
-        owned_games = steam.get_owned_games(user.id)
-        for owned_game in owned_games:
-            game = update_game(owned_game["appid"])
-            if not game:
-                continue
-            last_played = (
-                None
-                if owned_game["rtime_last_played"] == 0
-                else dt.datetime.fromtimestamp(owned_game["rtime_last_played"])
-            )
-            user_game, _ = UserGame.get_or_create(user=user, game=game)
-            old_playtime = int(user_game.playtime)
-            user_game.last_played = last_played
-            user_game.playtime = owned_game["playtime_forever"]
-            user_game.save()
-            # if old_playtime != user_game.playtime:
-            update_normalization(user, game)
-        user.last_games_update_time = dt.datetime.now()
-        user.save()
-        games = Game.select().join(UserGame).where(UserGame.user == user)
-        for game in games:
-            update_game_stats(game)
+        enqueue("sync_library", user)
+    job = get_last_job("sync_library", user)
     user_games = (
         UserGame.select()
         .where(UserGame.user == user)
         .order_by(UserGame.playtime.desc())
     )
-    return render_template("user/games.html", user_games=user_games, user=user)
+    return render_template(
+        "user/games.html", user_games=user_games, user=user, job=job
+    )
 
 
 @bp.route("/<username>/recommendations")
 def recommendations(username: str):
-    user = get_object_or_404(User, User.username == username)
-    update_cbr_for_user(user)
-    update_mbcf_for_user(user)
-    update_mobcf_for_user(user)
-    update_hr_for_user(user)
-    cbr_result = get_readable_result_for_games(user.cbr, 9)
-    mbcf_result = get_readable_result_for_games(user.mbcf, 9)
-    mobcf_result = get_readable_result_for_games(user.mobcf, 9)
-    hrs_result = get_readable_result_for_games(user.hr, 9)
+    user = get_object_or_404(User.slim(), User.username == username)
+    # computed by the worker, pages only read the recommendation table
+    if user_recommendations_stale(user):
+        enqueue("update_recommendations", user)
+    job = get_last_job("update_recommendations", user)
+    cbr_result = get_recommended_games("user", user.id, "cbr", 9)
+    mbcf_result = get_recommended_games("user", user.id, "mbcf", 9)
+    mobcf_result = get_recommended_games("user", user.id, "mobcf", 9)
+    hrs_result = get_recommended_games("user", user.id, "hr", 9)
     return render_template(
         "user/recommendations.html",
         user=user,
+        job=job,
         cbr_result=cbr_result,
         mbcf_result=mbcf_result,
         mobcf_result=mobcf_result,
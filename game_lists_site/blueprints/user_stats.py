@@ -18,7 +18,7 @@ bp = Blueprint("user_stats", __name__, url_prefix="/user")
 
 @bp.route("/<username>/stats/overview", methods=["GET"])
 def overview(username: str):
-    user = get_object_or_404(User, User.username == username)
+    user = get_object_or_404(User.slim(), User.username == username)
     stats = {}
     user_game = UserGame.select(UserGame.playtime, UserGame.score, UserGame.game).where(
         UserGame.user == user
@@ -158,7 +158,7 @@ def get_features_stats(user, feature_type, exclude_without_score=False):
 
 @bp.route("/<username>/stats/genres")
 def genres(username: str):
-    user = get_object_or_404(User, User.username == username)
+    user = get_object_or_404(User.slim(), User.username == username)
     exclude_without_score = request.args.get("exclude_without_score", False)
     exclude_without_score = exclude_without_score == "true"
     stats = get_features_stats(user, "genre", exclude_without_score)
@@ -174,7 +174,7 @@ def genres(username: str):
 
 @bp.route("/<username>/stats/tags")
 def tags(username: str):
-    user = get_object_or_404(User, User.username == username)
+    user = get_object_or_404(User.slim(), User.username == username)
     exclude_without_score = request.args.get("exclude_without_score", "")
     exclude_without_score = exclude_without_score == "true"
     stats = get_features_stats(user, "tag", exclude_without_score)
@@ -190,7 +190,7 @@ def tags(username: str):
 
 @bp.route("/<username>/stats/developers")
 def developers(username: str):
-    user = get_object_or_404(User, User.username == username)
+    user = get_object_or_404(User.slim(), User.username == username)
     exclude_without_score = request.args.get("exclude_without_score", False)
     exclude_without_score = exclude_without_score == "true"
     stats = get_features_stats(user, "developer", exclude_without_score)
@@ -0,0 +1,678 @@
+"""Writes store data for games into the catalog tables.
+
+Developer, genre and tag ids are cached in process, links are diffed against
+what is stored and the changes are applied with bulk statements, so saving a
+game takes the same few queries however many tags it has.
+"""
+
+import datetime as dt
+import json
+import math
+import random
+import threading
+import time
+
+import click
+from flask.cli import AppGroup
+from peewee import EXCLUDED, OperationalError, Value, chunked
+from psycopg2.extras import execute_values
+
+import game_lists_site.utils.steam as steam
+from game_lists_site.migrations import schema_required
+from game_lists_site.models import (
+    AppRedirect,
+    Developer,
+    Game,
+    GameDescription,
+    GameDeveloper,
+    GameGenre,
+    GameTag,
+    Genre,
+    SkippedApp,
+    Tag,
+    db,
+    is_postgres,
+)
+
+developers_fix = {
+    "FromSoftware, Inc.": "FromSoftware",
+    "FromSoftware, Inc": "FromSoftware",
+    "FromSoftware Inc.": "FromSoftware",
+    "Aspyr(Linux)": "Aspyr",
+    "Aspyr(Mac)": "Aspyr",
+    "Aspyr (Mac, Linux, & Windows Update)": "Aspyr",
+    "Aspyr (Mac)": "Aspyr",
+    "Feral Interactive (Mac/Linux)": "Feral Interactive",
+    "Feral Interactive (Mac)": "Feral Interactive",
+    "Feral Interactive (Linux)": "Feral Interactive",
+    "Feral Interactive": "Feral Interactive",
+}
+genre_blacklist = set(range(50, 60 + 1)) | set(range(80, 85 + 1))
+FREE_TO_PLAY_GENRE = 37
+BATCH_SIZE = 1000
+STALE_DAYS = 30
+# first key of the postgres advisory locks held while fetching an app
+APP_LOCK_SPACE = 1
+# apps are unlocked one by one as they are saved, a batch only bounds how long
+# the last of them stays locked
+LOCK_BATCH_SIZE = 50
+# seconds to wait for another fetch of an app at a time
+WAIT_TIMEOUT = 10
+# times to wait for another fetch of an app before giving up on it
+WAIT_ATTEMPTS = 3
+DAY = 24 * 60 * 60
+# seconds an app is not fetched again, by reason, None is never
+SKIP_TTLS = {
+    "legacy": None,
+    "no_details": 30 * DAY,
+    "blacklisted_genre": 90 * DAY,
+    "failed": 60 * 60,
+}
+# appids that were skipped before there was a skippedapp table
+legacy_skipped_ids = [
+    202090,
+    205790,
+    214850,
+    217490,
+    225140,
+    226320,
+    239450,
+    250820,
+    285030,
+    310380,
+    323370,
+    36700,
+    388080,
+    404790,
+    41010,
+    413850,
+    413851,
+    413852,
+    413853,
+    413854,
+    413855,
+    413856,
+    413857,
+    413858,
+    413859,
+    431960,
+    458250,
+    458260,
+    458270,
+    458280,
+    458300,
+    458310,
+    458320,
+    497810,
+    497811,
+    497812,
+    497813,
+    585280,
+    585281,
+    585282,
+    585283,
+    607380,
+    623990,
+    700580,
+]
+
+developer_ids = {}
+tag_ids = {}
+genre_ids = set()
+cache_lock = threading.Lock()
+
+
+def clear_caches():
+    # the cached ids are only valid while the rows exist, e.g. not after a
+    # rolled back transaction
+    with cache_lock:
+        developer_ids.clear()
+        tag_ids.clear()
+        genre_ids.clear()
+
+
+def parse_app(app):
+    """Turn what steam.get_app returned into catalog rows.
+
+    Returns None for apps the catalog does not keep.
+    """
+    if not app:
+        return None
+    data = app["details"]
+    genres = {
+        int(genre["id"]): genre["description"] for genre in data.get("genres", [])
+    }
+    if genre_blacklist & genres.keys():
+        return None
+    release_date = None
+    if data.get("release_date", {}).get("date"):
+        try:
+            release_date = dt.datetime.strptime(
+                data["release_date"]["date"], "%d %b, %Y"
+            ).date()
+        except ValueError:
+            pass
+    return {
+        "game": {
+            "id": int(data["steam_appid"]),
+            "name": data["name"],
+            "release_date": release_date,
+            "image_url": data.get("header_image"),
+            "free_to_play": FREE_TO_PLAY_GENRE in genres,
+            "rating": app["rating"],
+        },
+        "description": data.get("about_the_game", ""),
+        "developers": list(
+            dict.fromkeys(
+                developers_fix.get(name, name) for name in data.get("developers", [])
+            )
+        ),
+        "genres": genres,
+        "tags": list(dict.fromkeys(app["tags"])),
+    }
+
+
+def get_name_ids(model, cache: dict, names):
+    """Ids of the developers or tags with these names, creating missing ones."""
+    missing = [name for name in names if name not in cache]
+    if missing:
+        for batch in chunked(missing, BATCH_SIZE):
+            model.insert_many(
+                [{model.name: name} for name in batch]
+            ).on_conflict_ignore().execute()
+        with cache_lock:
+            for batch in chunked(missing, BATCH_SIZE):
+                for id, name in (
+                    model.select(model.id, model.name)
+                    .where(model.name.in_(batch))
+                    .tuples()
+                ):
+                    cache[name] = id
+    return [cache[name] for name in names]
+
+
+def ensure_genres(genres: dict):
+    missing = [id for id in genres if id not in genre_ids]
+    if missing:
+        Genre.insert_many(
+            [{Genre.id: id, Genre.name: genres[id]} for id in missing]
+        ).on_conflict_ignore().execute()
+        with cache_lock:
+            genre_ids.update(missing)
+
+
+link_tables = {
+    "developer": (GameDeveloper, GameDeveloper.developer),
+    "genre": (GameGenre, GameGenre.genre),
+    "tag": (GameTag, GameTag.tag),
+}
+
+
+def get_links(game_ids):
+    """{(game_id, kind): {linked id}} for the games, in a single query."""
+    queries = [
+        model.select(Value(kind), model.game, field).where(model.game.in_(game_ids))
+        for kind, (model, field) in link_tables.items()
+    ]
+    query = queries[0]
+    for other in queries[1:]:
+        query = query.union_all(other)
+    links = {}
+    for kind, game_id, linked_id in query.tuples():
+        links.setdefault((game_id, kind), set()).add(linked_id)
+    return links
+
+
+def insert_rows(model, fields: list, rows: list, update: list = None):
+    """Multi-row insert of tuples of plain values, ignoring conflicts or
+    upserting on the primary key.
+
+    update are the fields to overwrite when a row with the same primary key
+    exists. On postgres the statements are built by psycopg2, for big batches
+    that is many times faster than building them with peewee.
+    """
+    if not rows:
+        return
+    if not is_postgres():
+        for batch in chunked(rows, BATCH_SIZE):
+            query = model.insert_many(batch, fields=fields)
+            if update:
+                query = query.on_conflict(
+                    conflict_target=[model._meta.primary_key],
+                    update={
+                        field: getattr(EXCLUDED, field.column_name) for field in update
+                    },
+                )
+            else:
+                query = query.on_conflict_ignore()
+            query.execute()
+        return
+    # peewee fills in python side defaults, so do the same for new rows
+    names = {field.name for field in fields}
+    defaults = [
+        field
+        for field in model._meta.sorted_fields
+        if field.name not in names and field.default is not None
+    ]
+    default_values = tuple(
+        field.default() if callable(field.default) else field.default
+        for field in defaults
+    )
+    columns = ", ".join(f'"{field.column_name}"' for field in fields + defaults)
+    sql = f'INSERT INTO "{model._meta.table_name}" ({columns}) VALUES %s ON CONFLICT '
+    if update:
+        sql += f'("{model._meta.primary_key.column_name}") DO UPDATE SET ' + ", ".join(
+            f'"{field.column_name}" = EXCLUDED."{field.column_name}"'
+            for field in update
+        )
+    else:
+        sql += "DO NOTHING"
+    if default_values:
+        rows = [row + default_values for row in rows]
+    execute_values(db.cursor(), sql, rows, page_size=BATCH_SIZE)
+
+
+def write_links(links: dict, old_links: dict):
+    """Apply the difference between old_links and links with bulk statements."""
+    for kind, (model, field) in link_tables.items():
+        added, removed = [], {}
+        for (game_id, link_kind), ids in links.items():
+            if link_kind != kind:
+                continue
+            old_ids = old_links.get((game_id, kind), set())
+            added += [(game_id, id) for id in ids - old_ids]
+            if old_ids - ids:
+                removed[game_id] = old_ids - ids
+        for game_id, ids in removed.items():
+            model.delete().where(
+                (model.game == game_id) & field.in_(list(ids))
+            ).execute()
+        insert_rows(model, [model.game, field], added)
+
+
+def save_games(rows):
+    """Upsert parsed apps (see parse_app) and their links in one transaction.
+
+    last_update_time is now unless the rows have their own.
+    """
+    if not rows:
+        return []
+    developer_names = list(dict.fromkeys(n for row in rows for n in row["developers"]))
+    developers = dict(
+        zip(developer_names, get_name_ids(Developer, developer_ids, developer_names))
+    )
+    tag_names = list(dict.fromkeys(n for row in rows for n in row["tags"]))
+    tags = dict(zip(tag_names, get_name_ids(Tag, tag_ids, tag_names)))
+    genres = {}
+    for row in rows:
+        genres.update(row["genres"])
+    ensure_genres(genres)
+    now = dt.datetime.now()
+    games = [{"last_update_time": now, **row["game"]} for row in rows]
+    links = {}
+    for row in rows:
+        game_id = row["game"]["id"]
+        links[(game_id, "developer")] = {developers[n] for n in row["developers"]}
+        links[(game_id, "genre")] = set(row["genres"])
+        links[(game_id, "tag")] = {tags[n] for n in row["tags"]}
+    fields = [getattr(Game, column) for column in games[0]]
+    with db.atomic():
+        insert_rows(
+            Game,
+            fields,
+            [tuple(game[field.name] for field in fields) for game in games],
+            update=[field for field in fields if field.name != "id"],
+        )
+        insert_rows(
+            GameDescription,
+            [GameDescription.game, GameDescription.description],
+            [(row["game"]["id"], row["description"]) for row in rows],
+            update=[GameDescription.description],
+        )
+        write_links(links, get_links([game["id"] for game in games]))
+    return games
+
+
+def get_skip_reasons(game_ids):
+    """{game_id: reason} for the apps that should not be fetched right now."""
+    now = dt.datetime.now()
+    reasons = {}
+    for batch in chunked(list(game_ids), BATCH_SIZE):
+        reasons.update(
+            SkippedApp.select(SkippedApp.id, SkippedApp.reason)
+            .where(
+                SkippedApp.id.in_(batch)
+                & (SkippedApp.expires_time.is_null() | (SkippedApp.expires_time > now))
+            )
+            .tuples()
+        )
+    return reasons
+
+
+def get_redirects(game_ids):
+    """{game_id: id of the game steam answers with} for redirected apps."""
+    redirects = {}
+    for batch in chunked(list(game_ids), BATCH_SIZE):
+        redirects.update(
+            AppRedirect.select(AppRedirect.id, AppRedirect.game)
+            .where(AppRedirect.id.in_(batch))
+            .tuples()
+        )
+    return redirects
+
+
+def skip_apps(game_ids, reason: str):
+    """Don't fetch these apps again for the TTL of reason."""
+    ttl = {**SKIP_TTLS, **steam.get_config("SKIPPED_APP_TTLS", {})}[reason]
+    now = dt.datetime.now()
+    expires_time = now + dt.timedelta(seconds=ttl) if ttl is not None else None
+    for batch in chunked(list(game_ids), BATCH_SIZE):
+        SkippedApp.insert_many(
+            [
+                {
+                    SkippedApp.id: game_id,
+                    SkippedApp.reason: reason,
+                    SkippedApp.skipped_time: now,
+                    SkippedApp.expires_time: expires_time,
+                }
+                for game_id in batch
+            ]
+        ).on_conflict(
+            conflict_target=[SkippedApp.id],
+            update={
+                SkippedApp.reason: EXCLUDED.reason,
+                SkippedApp.skipped_time: EXCLUDED.skipped_time,
+                SkippedApp.expires_time: EXCLUDED.expires_time,
+            },
+        ).execute()
+
+
+def skip_app(game_id: int, reason: str):
+    skip_apps([game_id], reason)
+
+
+def lock_apps(game_ids):
+    """Claim apps for fetching, returns the ones no other connection holds.
+
+    The locks are advisory session locks, release them with unlock_apps.
+    """
+    game_ids = list(game_ids)
+    if not game_ids or not is_postgres():
+        return game_ids
+    cursor = db.execute_sql(
+        "SELECT id FROM unnest(%s::int[]) AS id WHERE pg_try_advisory_lock(%s, id)",
+        (game_ids, APP_LOCK_SPACE),
+    )
+    claimed = {id for id, in cursor.fetchall()}
+    return [game_id for game_id in game_ids if game_id in claimed]
+
+
+def unlock_apps(game_ids):
+    game_ids = list(game_ids)
+    if not game_ids or not is_postgres():
+        return
+    db.execute_sql(
+        "SELECT pg_advisory_unlock(%s, id) FROM unnest(%s::int[]) AS id",
+        (APP_LOCK_SPACE, game_ids),
+    )
+
+
+def wait_for_apps(game_ids, timeout: float = WAIT_TIMEOUT):
+    """Block until nobody holds the locks of these apps, up to timeout seconds
+    for each. Returns False if it timed out."""
+    game_ids = list(game_ids)
+    if not game_ids or not is_postgres():
+        return True
+    try:
+        with db.atomic():
+            db.execute_sql(f"SET LOCAL lock_timeout = {int(timeout * 1000)}")
+            # one shared lock at a time, released before the next is taken,
+            # so a timeout leaves none held
+            db.execute_sql(
+                "SELECT pg_advisory_lock_shared(%s, id), "
+                "pg_advisory_unlock_shared(%s, id) FROM unnest(%s::int[]) AS id",
+                (APP_LOCK_SPACE, APP_LOCK_SPACE, game_ids),
+            )
+            db.execute_sql("SET LOCAL lock_timeout = DEFAULT")
+    except OperationalError as e:
+        print(e)
+        return False
+    return True
+
+
+def save_game(game_id: int, game, app):
+    """Store one fetched app, returns the game or None if it is not kept.
+
+    Apps that are not kept go to the skipped apps cache.
+    """
+    row = parse_app(app)
+    if not row:
+        if app:
+            # filtered out, e.g. a blacklisted genre
+            with db.atomic():
+                Game.delete().where(Game.id == app["details"]["steam_appid"]).execute()
+                skip_app(game_id, "blacklisted_genre")
+        else:
+            skip_app(game_id, "no_details")
+        return None
+    fields = save_games([row])[0]
+    if fields["id"] != game_id:
+        # fetched through its target from now on
+        AppRedirect.insert(id=game_id, game=fields["id"]).on_conflict(
+            conflict_target=[AppRedirect.id],
+            update={AppRedirect.game: EXCLUDED.game_id},
+        ).execute()
+    if game is None or game.id != fields["id"]:
+        return Game(**fields)
+    for name, value in fields.items():
+        setattr(game, name, value)
+    return game
+
+
+def get_refresh_ids(days: float = 1, limit: int = None):
+    """Games to refresh in a run of a command that runs every `days` days.
+
+    Missing and stale games always go first. On top of them each run takes a
+    share of the catalog, oldest first, so that the whole catalog is refreshed
+    over STALE_DAYS days instead of going stale at the same time.
+    """
+    stale = Game.last_update_time.is_null() | (
+        Game.last_update_time < dt.datetime.now() - dt.timedelta(days=STALE_DAYS)
+    )
+    ids = [
+        id
+        for id, in Game.select(Game.id)
+        .where(stale)
+        .order_by(Game.last_update_time.asc(nulls="first"))
+        .tuples()
+    ]
+    share = math.ceil(Game.select().count() * days / STALE_DAYS)
+    if share > len(ids):
+        ids += [
+            id
+            for id, in Game.select(Game.id)
+            .where(~stale)
+            .order_by(Game.last_update_time)
+            .limit(share - len(ids))
+            .tuples()
+        ]
+    return ids[:limit] if limit else ids
+
+
+def refresh_catalog(game_ids, max_workers: int = None, report_interval=10):
+    """Fetch games in parallel and save them as they arrive.
+
+    Apps in the skipped apps cache are left out.
+    """
+    counts = {"refreshed": 0, "removed": 0, "failed": 0, "busy": 0}
+    start = last_report = time.monotonic()
+    skipped = get_skip_reasons(game_ids)
+    game_ids = [game_id for game_id in game_ids if game_id not in skipped]
+    counts["skipped"] = len(skipped)
+    done = 0
+    for batch in chunked(game_ids, LOCK_BATCH_SIZE):
+        # games a sync is fetching right now are refreshed by it
+        claimed = lock_apps(batch)
+        counts["busy"] += len(batch) - len(claimed)
+        locked = set(claimed)
+        try:
+            for game_id, app in steam.get_apps(claimed, max_workers):
+                if isinstance(app, steam.SteamError):
+                    print(app)
+                    skip_app(game_id, "failed")
+                    counts["failed"] += 1
+                elif save_game(game_id, None, app):
+                    counts["refreshed"] += 1
+                else:
+                    counts["removed"] += 1
+                # whoever waits for this app can go on
+                unlock_apps([game_id])
+                locked.discard(game_id)
+                done += 1
+                now = time.monotonic()
+                if now - last_report >= report_interval:
+                    click.echo(
+                        f"{done}/{len(game_ids)}, {done / (now - start):.1f} games/s"
+                    )
+                    last_report = now
+        finally:
+            unlock_apps(locked)
+    counts["seconds"] = time.monotonic() - start
+    return counts
+
+
+def read_dump(path):
+    """Yield apps in the shape of steam.get_app from a json or ndjson dump.
+
+    A record is either that shape, bare app details with tags (and rating) next
+    to the details fields, or an appdetails answer ({"success": ..., "data":
+    ...}). A json dump is a list of records or an object of them by appid.
+    Records without details are yielded as (appid, None).
+    """
+    with open(path, encoding="utf-8") as file:
+        text = file.read()
+    try:
+        records = json.loads(text)
+    except json.JSONDecodeError:
+        records = (json.loads(line) for line in text.splitlines() if line.strip())
+    else:
+        if isinstance(records, dict) and not records.keys() & {
+            "steam_appid",
+            "details",
+            "success",
+        }:
+            records = [
+                {"steam_appid": int(key), **value} if "success" in value else value
+                for key, value in records.items()
+            ]
+        elif isinstance(records, dict):
+            records = [records]
+    for record in records:
+        if "success" in record:
+            if not record["success"] or "data" not in record:
+                yield int(record["steam_appid"]), None
+                continue
+            record = record["data"]
+        if "details" in record:
+            app = {"tags": [], "rating": 0, **record}
+        else:
+            details = dict(record)
+            app = {
+                "details": details,
+                "tags": details.pop("tags", []),
+                "rating": details.pop("rating", 0),
+            }
+        yield int(app["details"]["steam_appid"]), app
+
+
+def import_dump(path, spread: bool = True):
+    """Load a dump of apps with the same rules as update_game.
+
+    Apps in the skipped apps cache are left out and apps the catalog does not
+    keep are added to it. With spread, last_update_time is spread over the
+    last STALE_DAYS days, so the imported games don't all go stale together.
+    """
+    counts = {"imported": 0, "skipped": 0, "removed": 0}
+    now = dt.datetime.now()
+    for batch in chunked(read_dump(path), BATCH_SIZE):
+        apps = dict(batch)
+        skipped = get_skip_reasons(apps)
+        counts["skipped"] += len(skipped)
+        rows, removed, no_details = [], [], []
+        for game_id, app in apps.items():
+            if game_id in skipped:
+                continue
+            row = parse_app(app)
+            if row:
+                if spread:
+                    row["game"]["last_update_time"] = now - dt.timedelta(
+                        days=random.uniform(0, STALE_DAYS)
+                    )
+                rows.append(row)
+            elif app:
+                removed.append(game_id)
+            else:
+                no_details.append(game_id)
+        with db.atomic():
+            save_games(rows)
+            if removed:
+                Game.delete().where(Game.id.in_(removed)).execute()
+                skip_apps(removed, "blacklisted_genre")
+            if no_details:
+                skip_apps(no_details, "no_details")
+        counts["imported"] += len(rows)
+        counts["removed"] += len(removed) + len(no_details)
+    return counts
+
+
+catalog_cli = AppGroup("catalog", help="Manage the game catalog.")
+
+
+@catalog_cli.command("refresh")
+@click.option("--days", default=1.0, help="How often this command runs, in days.")
+@click.option("--limit", type=int, help="Refresh at most this many games.")
+@click.option("--workers", type=int, help="Parallel Steam requests.")
+@schema_required
+def refresh_command(days, limit, workers):
+    """Refresh missing and stale games from Steam."""
+    game_ids = get_refresh_ids(days, limit)
+    click.echo(f"refreshing {len(game_ids)} games")
+    counts = refresh_catalog(game_ids, workers)
+    click.echo(
+        f"refreshed {counts['refreshed']}, removed {counts['removed']}, "
+        f"failed {counts['failed']}, busy {counts['busy']}, "
+        f"skipped {counts['skipped']} in {counts['seconds']:.1f}s "
+        f"({len(game_ids) / max(counts['seconds'], 1e-9):.1f} games/s)"
+    )
+    click.echo(f"pruned {steam.get_cache().prune()} old steam responses")
+
+
+@catalog_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--no-spread",
+    is_flag=True,
+    help="Mark every game as updated now instead of over the last month.",
+)
+@schema_required
+def import_command(path, no_spread):
+    """Load a json or ndjson dump of app details into the catalog."""
+    start = time.monotonic()
+    counts = import_dump(path, not no_spread)
+    seconds = time.monotonic() - start
+    click.echo(
+        f"imported {counts['imported']}, skipped {counts['skipped']}, "
+        f"removed {counts['removed']} in {seconds:.1f}s "
+        f"({counts['imported'] / max(seconds, 1e-9):.0f} games/s)"
+    )
+
+
+@catalog_cli.command("skip-legacy")
+@schema_required
+def skip_legacy_command():
+    """Add the appids skipped before the skippedapp table to it again.
+
+    `flask db upgrade` adds them once, this puts back ones removed since.
+    """
+    skip_apps(legacy_skipped_ids, "legacy")
+    click.echo(f"skipped {len(legacy_skipped_ids)} apps")
@@ -0,0 +1,121 @@
+"""Recall and latency of the ann index against exact nearest neighbours.
+
+Indexes synthetic game features (see benchmark_cbr) reduced the way
+update_cbr_for_game does, saves the index and memory-maps it like a web
+worker. Recall@k compares similar() with the exact cbr lists users see, the
+top-k cosine of the full feature vectors (ties with the last game of a list
+count as found), and svd recall@k with the exact top-k of the reduced
+vectors the index holds, which leaves out what the reduction loses. Latency
+is per similar() call.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize as sk_normalize
+
+from game_lists_site.algorithms.game import reduce_dimensions, top_k_cosine
+from game_lists_site.ann import AnnIndex, normalize
+from game_lists_site.experiments.benchmark_cbr import features
+
+
+def exact(vectors, rows, k: int):
+    similarities = vectors[rows] @ vectors.T
+    similarities[np.arange(len(rows)), rows] = -np.inf
+    return list(np.argsort(-similarities, axis=1)[:, :k])
+
+
+def exact_cbr(X, rows, k: int):
+    """The cbr lists of rows as update_cbr_for_game saves them, (columns,
+    scores) best first."""
+    lists = {}
+    wanted = set(rows.tolist())
+    for row, columns, scores in top_k_cosine(X, k):
+        if row in wanted:
+            lists[row] = columns, scores
+    return [lists[row] for row in rows]
+
+
+def recall(X, rows, found_lists, expected_lists):
+    """Share of the exact lists found, a game tied with the last of its list
+    counts as found, the exact list could have had it instead."""
+    X = sk_normalize(X)
+    found = 0
+    for row, found_columns, (columns, scores) in zip(rows, found_lists, expected_lists):
+        if not len(columns):
+            continue
+        found_scores = (X[found_columns] @ X[row].T).toarray().ravel()
+        found += min(np.sum(found_scores >= scores[-1] - 1e-6), len(columns))
+    return found / max(sum(len(columns) for columns, _ in expected_lists), 1)
+
+
+def svd_recall(found_lists, expected_lists):
+    found = sum(
+        len(set(found) & set(expected))
+        for found, expected in zip(found_lists, expected_lists)
+    )
+    return found / max(sum(len(expected) for expected in expected_lists), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--games", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--tags", type=int, default=400)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument(
+        "--list-factors",
+        type=float,
+        nargs="+",
+        default=[2, 4, 8],
+        help="Lists per square root of the game count.",
+    )
+    parser.add_argument("--probes", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    for games in args.games:
+        X = CountVectorizer().fit_transform(features(games, args.tags))
+        vectors = reduce_dimensions(X).astype(np.float32)
+        ids = np.arange(10, 10 * games + 1, 10)
+        rows = np.random.default_rng(1).choice(games, args.queries, replace=False)
+        expected = exact_cbr(X, rows, args.top_k)
+        expected_svd = exact(normalize(vectors), rows, args.top_k)
+        print(f"{games} games, {vectors.shape[1]} dimensions:")
+        for factor in args.list_factors:
+            start = time.perf_counter()
+            index = AnnIndex.build(ids, vectors, int(factor * np.sqrt(games)))
+            build = time.perf_counter() - start
+            with tempfile.TemporaryDirectory() as directory:
+                index.save(Path(directory) / "index")
+                index = AnnIndex.load(Path(directory) / "index")
+                size = sum(path.stat().st_size for path in Path(directory).glob("*/*"))
+                print(
+                    f"  {len(index.centroids)} lists: "
+                    f"build {build:5.2f}s, {size / 2**20:5.1f}MiB"
+                )
+                for probes in args.probes:
+                    found, latencies = [], []
+                    for row in rows:
+                        start = time.perf_counter()
+                        result = index.similar(ids[row], args.top_k, probes)
+                        latencies.append(time.perf_counter() - start)
+                        found.append(list(result))
+                    rows_found = [
+                        np.searchsorted(ids, list(result)) for result in found
+                    ]
+                    latencies = np.array(latencies) * 1000
+                    print(
+                        f"    {probes} probes: recall@{args.top_k} "
+                        f"{recall(X, rows, rows_found, expected):.3f}, "
+                        f"svd recall@{args.top_k} "
+                        f"{svd_recall(found, [ids[e] for e in expected_svd]):.3f}, "
+                        f"median {np.median(latencies):.3f}ms, p99 "
+                        f"{np.percentile(latencies, 99):.3f}ms"
+                    )
+
+
+if __name__ == "__main__":
+    main()
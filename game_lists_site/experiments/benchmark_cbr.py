@@ -0,0 +1,91 @@
+"""Time and peak memory of the content-based game similarities.
+
+Builds a synthetic catalog whose features look like Game.features (a
+developer and a handful of tags drawn with a skewed popularity) and runs the
+blocked top-K cosine of algorithms.game on it. Up to --reference-max games,
+it also runs the previous full cosine_similarity matrix and checks that both
+give the same top-K scores. Peak memory is what numpy and scipy allocated,
+measured with tracemalloc.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from game_lists_site.algorithms.game import top_k_cosine
+
+
+def features(games: int, tags: int):
+    rng = np.random.default_rng(0)
+    popularity = 1 / np.arange(1, tags + 1)
+    popularity /= popularity.sum()
+    return [
+        " ".join(
+            [f"Developer{rng.integers(games // 3 + 1)}"]
+            + [
+                f"Tag{tag}"
+                for tag in rng.choice(
+                    tags, rng.integers(5, 20), replace=False, p=popularity
+                )
+            ]
+        )
+        for _ in range(games)
+    ]
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+
+def full_matrix(X, k: int):
+    similarities = cosine_similarity(X, X)
+    np.fill_diagonal(similarities, -1)
+    return [np.sort(row)[::-1][:k] for row in similarities]
+
+
+def blocked(X, k: int, block_bytes: int, workers: int):
+    return [
+        scores for _, _, scores in top_k_cosine(X, k, block_bytes, workers or None)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--games", type=int, nargs="+", default=[2000, 10000, 50000])
+    parser.add_argument("--tags", type=int, default=400)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--block-mib", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0, help="0 is one per cpu.")
+    parser.add_argument("--reference-max", type=int, default=10000)
+    args = parser.parse_args()
+    for games in args.games:
+        X = CountVectorizer().fit_transform(features(games, args.tags))
+        print(f"{games} games, {X.shape[1]} features:")
+        scores, seconds, peak = measure(
+            lambda: blocked(X, args.top_k, args.block_mib * 2**20, args.workers)
+        )
+        print(f"  blocked top-k: {seconds:7.2f}s, peak {peak:8.1f}MiB")
+        if games > args.reference_max:
+            continue
+        reference, seconds, peak = measure(lambda: full_matrix(X, args.top_k))
+        print(f"    full matrix: {seconds:7.2f}s, peak {peak:8.1f}MiB")
+        same = all(
+            np.allclose(row, expected[expected > 0][: len(row)], atol=1e-5)
+            and len(row) == np.count_nonzero(expected > 0)
+            for row, expected in zip(scores, reference)
+        )
+        print(f"  same top-k scores: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Ingestion benchmarks against a local fake steam.
+
+For every library size, syncs a new user from scratch (cold) and then again
+with nothing changed (warm), and reports wall-clock time, games/s, database
+queries per game and steam requests per game. Every run happens inside a
+transaction that is rolled back, so nothing is left in the database.
+--database runs against another database, e.g. an sqlite file.
+"""
+
+import argparse
+import io
+import sys
+import time
+from contextlib import contextmanager, redirect_stdout
+
+from flask import Flask
+
+import game_lists_site.catalog as catalog
+import game_lists_site.utils.steam as steam
+from game_lists_site.models import DATABASE, User, db, init_db
+from game_lists_site.sync import sync_library
+from game_lists_site.utils.fake_steam import FakeSteam
+
+STEAM_ID = 76561197960287930
+
+
+class CountingCursor:
+    """Counts the statements sent through a db-api cursor."""
+
+    def __init__(self, cursor, counts):
+        self.cursor = cursor
+        self.counts = counts
+
+    def execute(self, *args, **kwargs):
+        self.counts["queries"] += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.counts["queries"] += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+@contextmanager
+def count_queries():
+    # at the cursor, so the statements that catalog.insert_rows sends with
+    # execute_values on postgres count too
+    counts = {"queries": 0}
+    database = db.obj
+    cursor = database.cursor
+
+    def counting_cursor(*args, **kwargs):
+        return CountingCursor(cursor(*args, **kwargs), counts)
+
+    database.cursor = counting_cursor
+    try:
+        yield counts
+    finally:
+        del database.cursor
+
+
+def measure(fake, run, games: int):
+    fake.reset_counts()
+    with count_queries() as counts, redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+    requests = sum(fake.requests.values())
+    return (
+        f"time: {elapsed:8.2f}s, games/s: {games / elapsed:8.1f}, "
+        f"queries/game: {counts['queries'] / games:6.2f}, "
+        f"requests/game: {requests / games:5.2f}, failures: {fake.failures}"
+    )
+
+
+def benchmark_sync(fake, size: int):
+    fake.library_size = size
+    with db.atomic() as transaction:
+        user = User.create(id=STEAM_ID, username="benchmark", password="")
+        try:
+            print(
+                f"{size:6} games, cold: {measure(fake, lambda: sync_library(user), size)}"
+            )
+            print(
+                f"{size:6} games, warm: {measure(fake, lambda: sync_library(user), size)}"
+            )
+        finally:
+            transaction.rollback()
+            catalog.clear_caches()
+
+
+def benchmark_fetch(fake, size: int, workers: int):
+    fake.library_size = size
+    with redirect_stdout(io.StringIO()):
+        app_ids = [game["appid"] for game in steam.get_owned_games(STEAM_ID)]
+    print(
+        f"{size:6} games, fetch only, {workers} workers: "
+        f"{measure(fake, lambda: list(steam.get_apps(app_ids, workers)), size)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=steam.FETCH_WORKERS)
+    parser.add_argument("--database", default=DATABASE)
+    args = parser.parse_args()
+    with FakeSteam(latency=args.latency, failure_rate=args.failure_rate) as fake:
+        app = Flask(__name__)
+        app.config.update(
+            fake.config(),
+            STEAM_FETCH_WORKERS=args.workers,
+            STEAM_RETRY_BACKOFF=0.01,
+            DATABASE=args.database,
+        )
+        init_db(app.config)
+        print(
+            f"latency: {args.latency}s, failure rate: {args.failure_rate}, "
+            f"workers: {args.workers}",
+            file=sys.stderr,
+        )
+        with app.app_context():
+            for size in args.sizes:
+                benchmark_fetch(fake, size, args.workers)
+                benchmark_sync(fake, size)
+
+
+if __name__ == "__main__":
+    main()
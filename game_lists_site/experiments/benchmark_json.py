@@ -0,0 +1,96 @@
+"""Encode/decode throughput and stored size of the JsonField codecs.
+
+Compares the stdlib json codec, orjson (when installed) and the packed
+ScoresField on payloads shaped like what the site stores: a normalized
+playtime matrix ({game_id: {user_id: value}}) and top-K lists ({id: score}).
+Runs without a database, only the field conversions are measured.
+"""
+
+import argparse
+import random
+import time
+
+from game_lists_site.models import (
+    BaseModel,
+    JsonCodec,
+    JsonField,
+    OrjsonCodec,
+    ScoresField,
+    orjson,
+)
+
+
+class Payload(BaseModel):
+    # never created, binds the fields to the database's blob adapter
+    json = JsonField(codec=JsonCodec())
+    orjson = JsonField(codec=OrjsonCodec())
+    packed = ScoresField()
+
+
+def playtime_matrix(games: int, users: int, density: float):
+    rng = random.Random(0)
+    user_ids = [76561197960265728 + i for i in range(users)]
+    return {
+        game_id: {
+            user_id: rng.random()
+            for user_id in rng.sample(user_ids, max(1, int(users * density)))
+        }
+        for game_id in range(10, 10 * games + 1, 10)
+    }
+
+
+def top_k(size: int):
+    rng = random.Random(0)
+    return {rng.randrange(10, 2_000_000): rng.random() for _ in range(size)}
+
+
+def measure(field, value, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        stored = field.db_value(value)
+    encode = (time.perf_counter() - start) / repeat
+    # blobs come wrapped in psycopg2.Binary, the database returns the bytes
+    stored = getattr(stored, "adapted", stored)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        field.python_value(stored)
+    decode = (time.perf_counter() - start) / repeat
+    return encode, decode, len(stored)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--density", type=float, default=0.02)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    fields = {"json": Payload.json}
+    if orjson:
+        fields["orjson"] = Payload.orjson
+    else:
+        print("orjson is not installed, skipping it")
+    fields["packed"] = Payload.packed
+    payloads = {
+        "playtime matrix": playtime_matrix(args.games, args.users, args.density),
+        f"top-{args.top_k}": top_k(args.top_k),
+    }
+    for name, payload in payloads.items():
+        values = sum(len(v) if isinstance(v, dict) else 1 for v in payload.values())
+        # small payloads need more rounds for a stable number
+        repeat = max(args.repeat, 100_000 // values)
+        print(f"{name}, {values} values:")
+        for field_name, field in fields.items():
+            encode, decode, size = measure(field, payload, repeat)
+            print(
+                f"  {field_name:>7}: encode {encode * 1000:9.3f}ms "
+                f"({values / encode / 1e6:6.2f}M values/s), "
+                f"decode {decode * 1000:9.3f}ms "
+                f"({values / decode / 1e6:6.2f}M values/s), "
+                f"size {size / 1024:10.1f}KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Startup cost of a web worker and of a training worker.
+
+Every run starts a fresh interpreter, which either builds the web app with
+create_app (what each web worker does) or imports the training code, and
+reports wall-clock import time, peak RSS and which heavy modules got loaded.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ("torch", "pandas", "sklearn", "scipy")
+SCENARIOS = {
+    "interpreter": "pass",
+    "web worker": (
+        "from game_lists_site import create_app\n"
+        "create_app({config})"
+    ),
+    "training": "import game_lists_site.algorithms.user",
+}
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(code: str, runs: int):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(code=code, heavy=HEAVY_MODULES)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return (
+        statistics.median(result["seconds"] for result in results),
+        # ru_maxrss is in KiB on linux
+        statistics.median(result["rss"] for result in results) / 1024,
+        results[-1]["heavy"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database", help="DATABASE of the web app.")
+    args = parser.parse_args()
+    config = {"SECRET_KEY": "benchmark"}
+    if args.database:
+        config["DATABASE"] = args.database
+    for name, code in SCENARIOS.items():
+        seconds, rss, heavy = measure(code.format(config=repr(config)), args.runs)
+        print(
+            f"{name:>12}: import {seconds:6.3f}s, peak rss {rss:7.1f}MiB, "
+            f"heavy modules: {', '.join(heavy) or 'none'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import io
+import time
+from contextlib import redirect_stdout
+
+from flask import Flask
+
+import game_lists_site.utils.steam as steam
+from game_lists_site.utils.fake_steam import FakeSteam
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Wall-clock time of fetching a library against a fake steam"
+    )
+    parser.add_argument("--games", type=int, default=1500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+    with FakeSteam(library_size=args.games, latency=args.latency) as fake:
+        app = Flask(__name__)
+        app.config.update(fake.config())
+        with app.app_context():
+            owned_games = steam.get_owned_games(76561197960287930)
+            app_ids = [owned_game["appid"] for owned_game in owned_games]
+            print(f"games: {len(app_ids)}, latency: {args.latency}s")
+            for workers in args.workers:
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    apps = list(steam.get_apps(app_ids, workers))
+                elapsed = time.perf_counter() - start
+                print(
+                    f"workers: {workers:3}, time: {elapsed:8.2f}s, "
+                    f"games/s: {len(apps) / elapsed:8.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
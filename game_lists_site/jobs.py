@@ -0,0 +1,229 @@
+"""Background jobs stored in the job table and run by `flask worker`."""
+
+import datetime as dt
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from peewee import IntegrityError, OperationalError, fn
+
+import game_lists_site.utils.steam as steam
+
+from game_lists_site.migrations import schema_required
+from game_lists_site.models import Job, User, db, is_postgres
+from game_lists_site.sync import refresh_player_summaries, sync_library
+
+ACTIVE_STATUSES = ("queued", "running")
+PROGRESS_INTERVAL = 1
+HEARTBEAT_INTERVAL = 30
+# a running job whose worker missed this many heartbeats is requeued
+STALE_JOB_TIMEOUT = dt.timedelta(seconds=10 * HEARTBEAT_INTERVAL)
+
+
+def same_job(kind: str, user=None):
+    if user is None:
+        return (Job.kind == kind) & Job.user.is_null()
+    return (Job.kind == kind) & (Job.user == user)
+
+
+def enqueue(kind: str, user=None):
+    """Queue a job unless the same job is already queued or running."""
+    active = same_job(kind, user) & Job.status.in_(ACTIVE_STATUSES)
+    job = Job.select().where(active).first()
+    if job:
+        return job
+    try:
+        with db.atomic():
+            return Job.create(kind=kind, user=user)
+    except IntegrityError:
+        # a concurrent enqueue got there first, see create_active_job_index
+        return Job.select().where(same_job(kind, user)).order_by(Job.id.desc()).get()
+
+
+def get_last_job(kind: str, user=None):
+    return (
+        Job.select(
+            Job.id,
+            Job.status,
+            Job.stage,
+            Job.progress,
+            Job.total,
+            Job.error,
+            Job.finished_time,
+        )
+        .where(same_job(kind, user))
+        .order_by(Job.id.desc())
+        .first()
+    )
+
+
+def claim_job():
+    """Take the oldest queued job, other workers skip the row while we hold it.
+
+    sqlite has no row locks, there the claim takes the database write lock.
+    """
+    with db.atomic() if is_postgres() else db.atomic("IMMEDIATE"):
+        query = Job.select().where(Job.status == "queued").order_by(Job.id).limit(1)
+        if is_postgres():
+            query = query.for_update("FOR UPDATE SKIP LOCKED")
+        job = query.first()
+        if job:
+            job.status = "running"
+            job.started_time = job.heartbeat_time = dt.datetime.now()
+            job.save()
+        return job
+
+
+def requeue_stale_jobs():
+    # jobs of a worker that died while running them, a long job of a live
+    # worker keeps its heartbeat fresh
+    last_sign_of_life = fn.COALESCE(Job.heartbeat_time, Job.started_time)
+    return (
+        Job.update(status="queued", started_time=None, heartbeat_time=None)
+        .where(
+            (Job.status == "running")
+            & (last_sign_of_life < dt.datetime.now() - STALE_JOB_TIMEOUT)
+        )
+        .execute()
+    )
+
+
+@contextmanager
+def heartbeat(job):
+    """Update the heartbeat of job every HEARTBEAT_INTERVAL while in the block.
+
+    The beats come from a thread of their own, so a job waiting on steam
+    for a long time without progress still counts as alive.
+    """
+    stop = threading.Event()
+
+    def beat():
+        with db.connection_context():
+            while not stop.wait(HEARTBEAT_INTERVAL):
+                try:
+                    Job.update(heartbeat_time=dt.datetime.now()).where(
+                        Job.id == job.id
+                    ).execute()
+                except OperationalError as e:
+                    # e.g. sqlite is locked, the next beat tries again
+                    print(f"job {job.id} heartbeat: {e}")
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def progress_reporter(job):
+    last_report = 0
+
+    def report(stage, done, total):
+        nonlocal last_report
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL or done >= total:
+            Job.update(stage=stage, progress=done, total=total).where(
+                Job.id == job.id
+            ).execute()
+            last_report = now
+
+    return report
+
+
+def run_sync_library(job):
+    user = User.get_by_id(job.user_id)
+    # the first sync has a user waiting for their games page
+    lane = "sync" if user.last_games_update_time else "interactive"
+    with steam.priority(lane, user.id):
+        sync_library(user, progress_reporter(job))
+
+
+def run_refresh_player_summaries(job):
+    with steam.priority("background"):
+        refresh_player_summaries(progress_reporter(job))
+
+
+def run_update_recommendations(job):
+    # torch, pandas and sklearn are only imported by workers that get this job
+    from game_lists_site.algorithms.user import update_recommendations_for_user
+
+    update_recommendations_for_user(User.slim().where(User.id == job.user_id).get())
+
+
+handlers = {
+    "sync_library": run_sync_library,
+    "refresh_player_summaries": run_refresh_player_summaries,
+    "update_recommendations": run_update_recommendations,
+}
+
+
+def run_job(job):
+    print(f"run job {job.id} {job.kind}")
+    try:
+        with heartbeat(job):
+            handlers[job.kind](job)
+    except Exception:
+        traceback.print_exc()
+        job.status = "failed"
+        job.error = traceback.format_exc(limit=5)
+    else:
+        job.status = "done"
+    job.finished_time = dt.datetime.now()
+    job.save(only=[Job.status, Job.error, Job.finished_time])
+
+
+def work(interval: float = 1, once: bool = False):
+    last_requeue = time.monotonic()
+    while True:
+        job = claim_job()
+        if job:
+            run_job(job)
+        elif once:
+            return
+        else:
+            if time.monotonic() - last_requeue >= HEARTBEAT_INTERVAL:
+                requeue_stale_jobs()
+                last_requeue = time.monotonic()
+            time.sleep(interval)
+
+
+def work_in_threads(threads: int, interval: float = 1, once: bool = False):
+    """Run jobs in several threads that share the steam request budget.
+
+    The steam client gives the requests of first syncs and syncs priority
+    over background jobs, so a new user doesn't wait behind a long refresh.
+    """
+    requeue_stale_jobs()
+    if threads <= 1:
+        return work(interval, once)
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                work(interval, once)
+            finally:
+                db.close()
+
+    workers = [threading.Thread(target=run, daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+@click.command("worker")
+@click.option("--interval", default=1.0, help="Seconds between polls when idle.")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty.")
+@click.option("--threads", default=4, help="Jobs to run at the same time.")
+@with_appcontext
+@schema_required
+def worker_command(interval, once, threads):
+    """Run queued background jobs."""
+    work_in_threads(threads, interval, once)
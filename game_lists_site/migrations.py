@@ -0,0 +1,294 @@
+"""Versioned schema migrations, applied with `flask db upgrade`.
+
+An empty database gets the current schema at once. A database that predates
+the migrations (its tables were created at import) goes through all of them,
+so each one checks what is already there before changing anything.
+"""
+
+import functools
+
+import click
+from flask.cli import AppGroup
+from peewee import BlobField, DateTimeField, FloatField, fn
+from playhouse.migrate import SchemaMigrator, migrate
+
+from game_lists_site.models import (
+    AppRedirect,
+    Developer,
+    Game,
+    GameDescription,
+    GameDeveloper,
+    GameTag,
+    Job,
+    JsonField,
+    RateLimit,
+    Recommendation,
+    SchemaVersion,
+    SkippedApp,
+    Tag,
+    db,
+    is_postgres,
+    models,
+)
+
+
+def get_columns(table: str):
+    return {column.name: column for column in db.get_columns(table)}
+
+
+def get_indexes(table: str):
+    return {index.name for index in db.get_indexes(table)}
+
+
+def get_migrator():
+    return SchemaMigrator.from_database(db.obj)
+
+
+def create_recommendation_index():
+    # on postgres it covers the reads, which only need item_id and score in
+    # rank order
+    include = " INCLUDE (item_id, score)" if is_postgres() else ""
+    db.execute_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS recommendation_subject "
+        "ON recommendation (subject_type, subject_id, algorithm, rank)" + include
+    )
+
+
+def create_active_job_index():
+    # one queued or running job of a kind per user, jobs without a user count
+    # as user 0
+    db.execute_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS job_active "
+        "ON job (kind, COALESCE(user_id, 0)) "
+        "WHERE status IN ('queued', 'running')"
+    )
+
+
+def add_playtime_square_sum():
+    # filled in by the next rebuild of the playtime aggregates
+    if "playtime_square_sum" not in get_columns("game"):
+        migrate(
+            get_migrator().add_column(
+                "game", "playtime_square_sum", FloatField(default=0)
+            )
+        )
+
+
+def make_names_unique():
+    """Merge developers and tags with the same name, then index the names."""
+    for model, link_field in (
+        (Developer, GameDeveloper.developer),
+        (Tag, GameTag.tag),
+    ):
+        table = model._meta.table_name
+        if f"{table}_name" in get_indexes(table):
+            continue
+        link = link_field.model
+        keep = dict(
+            model.select(model.name, fn.MIN(model.id)).group_by(model.name).tuples()
+        )
+        duplicates = {
+            id: keep[name]
+            for id, name in model.select(model.id, model.name).tuples()
+            if keep[name] != id
+        }
+        for id, keep_id in duplicates.items():
+            # games linked to both already have the link that is kept
+            link.delete().where(
+                (link_field == id)
+                & link.game.in_(link.select(link.game).where(link_field == keep_id))
+            ).execute()
+            link.update({link_field: keep_id}).where(link_field == id).execute()
+        if duplicates:
+            print(f"merged {len(duplicates)} duplicate {table} names")
+            model.delete().where(model.id.in_(list(duplicates))).execute()
+        migrate(get_migrator().add_index(table, ("name",), unique=True))
+
+
+def create_new_tables():
+    db.create_tables([Job, SkippedApp, Recommendation, GameDescription])
+    create_recommendation_index()
+    # the index of the /games listing
+    Game._schema.create_indexes()
+
+
+def drop_json_columns():
+    # recommendations live in the recommendation table, normalized playtimes
+    # are computed from the playtime aggregates
+    migrator = get_migrator()
+    for table, names in (
+        ("game", ("cbr", "hr", "mbcf", "normalization")),
+        ("user", ("cbr", "similar_users", "mbcf", "mobcf", "hr", "normalization")),
+    ):
+        columns = get_columns(table)
+        operations = [
+            migrator.drop_column(table, name) for name in names if name in columns
+        ]
+        if operations:
+            migrate(*operations)
+
+
+def move_descriptions():
+    if "description" not in get_columns("game"):
+        return
+    db.execute_sql(
+        "INSERT INTO gamedescription (game_id, description) "
+        "SELECT id, description FROM game WHERE description IS NOT NULL "
+        "AND id NOT IN (SELECT game_id FROM gamedescription)"
+    )
+    migrate(get_migrator().drop_column("game", "description"))
+
+
+def add_system_scores():
+    if "scores" not in get_columns("system"):
+        migrate(get_migrator().add_column("system", "scores", BlobField(null=True)))
+
+
+def convert_json_columns():
+    """Text json columns to jsonb, which new postgres databases get."""
+    if not is_postgres():
+        return
+    for model in models:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue
+        columns = get_columns(table)
+        for field in model._meta.sorted_fields:
+            column = columns.get(field.column_name)
+            if isinstance(field, JsonField) and column and column.data_type == "text":
+                db.execute_sql(
+                    f'ALTER TABLE "{table}" ALTER COLUMN "{field.column_name}" '
+                    f'TYPE jsonb USING "{field.column_name}"::jsonb'
+                )
+
+
+def create_rate_limit_table():
+    db.create_tables([RateLimit])
+
+
+def add_job_heartbeat_time():
+    if "heartbeat_time" not in get_columns("job"):
+        migrate(
+            get_migrator().add_column("job", "heartbeat_time", DateTimeField(null=True))
+        )
+
+
+def make_active_jobs_unique():
+    # the duplicates enqueued before the index, the oldest one runs
+    first = Job.alias()
+    duplicate = fn.EXISTS(
+        first.select().where(
+            (first.kind == Job.kind)
+            & (fn.COALESCE(first.user, 0) == fn.COALESCE(Job.user, 0))
+            & first.status.in_(("queued", "running"))
+            & (first.id < Job.id)
+        )
+    )
+    Job.update(status="failed", error="duplicate of an earlier job").where(
+        Job.status.in_(("queued", "running")) & duplicate
+    ).execute()
+    create_active_job_index()
+
+
+def create_app_redirect_table():
+    db.create_tables([AppRedirect])
+
+
+def skip_legacy_apps():
+    """Seed skippedapp with the appids that used to be hardcoded."""
+    # catalog imports this module
+    from game_lists_site.catalog import legacy_skipped_ids, skip_apps
+
+    skip_apps(legacy_skipped_ids, "legacy")
+
+
+# (version, name, migration), in order. Never edit or reorder applied ones,
+# add a new migration instead.
+MIGRATIONS = [
+    (1, "add game.playtime_square_sum", add_playtime_square_sum),
+    (2, "make developer and tag names unique", make_names_unique),
+    (3, "create the job, recommendation and other new tables", create_new_tables),
+    (4, "drop recommendation and normalization json columns", drop_json_columns),
+    (5, "move game descriptions to gamedescription", move_descriptions),
+    (6, "add system.scores", add_system_scores),
+    (7, "store json columns as jsonb", convert_json_columns),
+    (8, "create the ratelimit table", create_rate_limit_table),
+    (9, "add job.heartbeat_time", add_job_heartbeat_time),
+    (10, "skip the legacy appids", skip_legacy_apps),
+    (11, "allow one active job of a kind per user", make_active_jobs_unique),
+    (12, "create the appredirect table", create_app_redirect_table),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version():
+    if not db.table_exists(SchemaVersion._meta.table_name):
+        return 0
+    return SchemaVersion.select(fn.MAX(SchemaVersion.version)).scalar() or 0
+
+
+def check_schema():
+    """None if the database is up to date, otherwise what to do about it."""
+    version = get_version()
+    if version == LATEST_VERSION:
+        return None
+    return (
+        f"database schema is at version {version}, this code needs "
+        f"{LATEST_VERSION}: run `flask db upgrade`"
+    )
+
+
+def schema_required(command):
+    """Refuse to run a cli command against an outdated schema."""
+
+    @functools.wraps(command)
+    def wrapper(*args, **kwargs):
+        error = check_schema()
+        if error:
+            raise click.ClickException(error)
+        return command(*args, **kwargs)
+
+    return wrapper
+
+
+def upgrade():
+    """Apply the missing migrations, returns their versions."""
+    with db.atomic():
+        version = get_version()
+        if version == 0 and not db.table_exists(Game._meta.table_name):
+            print("create schema")
+            db.create_tables(models)
+            create_recommendation_index()
+            create_active_job_index()
+            # the only migration that adds data instead of schema
+            skip_legacy_apps()
+            SchemaVersion.insert_many(
+                [{"version": number, "name": name} for number, name, _ in MIGRATIONS]
+            ).execute()
+            return [number for number, _, _ in MIGRATIONS]
+        SchemaVersion.create_table()
+        applied = []
+        for number, name, migration in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"migration {number}: {name}")
+            migration()
+            SchemaVersion.create(version=number, name=name)
+            applied.append(number)
+        return applied
+
+
+db_cli = AppGroup("db", help="Manage the database schema.")
+
+
+@db_cli.command("upgrade")
+def upgrade_command():
+    """Create the schema or bring it up to date."""
+    applied = upgrade()
+    click.echo(f"schema is at version {LATEST_VERSION}, applied {len(applied)}")
+
+
+@db_cli.command("version")
+def version_command():
+    """Show the schema version of the database."""
+    click.echo(check_schema() or f"schema is up to date, version {LATEST_VERSION}")
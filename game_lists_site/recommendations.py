@@ -0,0 +1,197 @@
+"""Top-K results of the recommendation algorithms.
+
+Every algorithm writes its ranked results for a user or a game to the
+recommendation table, cut to RECOMMENDATION_TOP_K items, and pages read them
+back with a LIMIT. The algorithms run in the worker or in
+`flask recommendations update`, never in the web app.
+"""
+
+import heapq
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from peewee import chunked
+
+import game_lists_site.ann as ann
+from game_lists_site.catalog import BATCH_SIZE, insert_rows
+from game_lists_site.migrations import schema_required
+from game_lists_site.models import Game, Recommendation, User, db
+from game_lists_site.utilities import days_delta
+
+TOP_K = 100
+# recommendations built before they are inserted
+INSERT_ROWS = 10000
+
+
+def get_top_k():
+    if has_app_context():
+        return current_app.config.get("RECOMMENDATION_TOP_K", TOP_K)
+    return TOP_K
+
+
+def subject_recommendations(subject_type: str, algorithm: str):
+    return (Recommendation.subject_type == subject_type) & (
+        Recommendation.algorithm == algorithm
+    )
+
+
+def save_recommendations(
+    subject_type: str, algorithm: str, results, replace_all: bool = False
+):
+    """Replace the results of the subjects in results.
+
+    results is a dict or an iterable of (subject_id, {item_id: score}), only
+    the top_k items of each are kept. It is consumed and written a chunk of
+    subjects at a time, in one transaction. With replace_all the results of
+    subjects missing from results are removed too.
+    """
+    top_k = get_top_k()
+    if isinstance(results, dict):
+        results = results.items()
+    fields = [
+        Recommendation.subject_type,
+        Recommendation.subject_id,
+        Recommendation.algorithm,
+        Recommendation.rank,
+        Recommendation.item_id,
+        Recommendation.score,
+    ]
+    with db.atomic():
+        if replace_all:
+            delete_recommendations(subject_type, algorithm)
+        for batch in chunked(results, max(1, min(BATCH_SIZE, INSERT_ROWS // top_k))):
+            if not replace_all:
+                Recommendation.delete().where(
+                    subject_recommendations(subject_type, algorithm)
+                    & Recommendation.subject_id.in_(
+                        [subject_id for subject_id, _ in batch]
+                    )
+                ).execute()
+            rows = []
+            for subject_id, scores in batch:
+                top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+                rows += [
+                    (
+                        subject_type,
+                        subject_id,
+                        algorithm,
+                        rank,
+                        int(item_id),
+                        float(score),
+                    )
+                    for rank, (item_id, score) in enumerate(top)
+                ]
+            insert_rows(Recommendation, fields, rows)
+
+
+def delete_recommendations(subject_type: str, algorithm: str, subject_id=None):
+    query = Recommendation.delete().where(
+        subject_recommendations(subject_type, algorithm)
+    )
+    if subject_id is not None:
+        query = query.where(Recommendation.subject_id == subject_id)
+    query.execute()
+
+
+def get_recommendations(
+    subject_type: str, subject_id: int, algorithm: str, limit: int = None
+):
+    """{item_id: score} of one subject, best first."""
+    query = (
+        Recommendation.select(Recommendation.item_id, Recommendation.score)
+        .where(
+            subject_recommendations(subject_type, algorithm)
+            & (Recommendation.subject_id == subject_id)
+        )
+        .order_by(Recommendation.rank)
+    )
+    if limit:
+        query = query.limit(limit)
+    return dict(query.tuples())
+
+
+def get_all_recommendations(
+    subject_type: str, algorithm: str, subject_ids=None, limit: int = None
+):
+    """{subject_id: {item_id: score}} of many subjects in one query."""
+    query = (
+        Recommendation.select(
+            Recommendation.subject_id, Recommendation.item_id, Recommendation.score
+        )
+        .where(subject_recommendations(subject_type, algorithm))
+        .order_by(Recommendation.subject_id, Recommendation.rank)
+    )
+    if subject_ids is not None:
+        query = query.where(Recommendation.subject_id.in_(list(subject_ids)))
+    if limit:
+        query = query.where(Recommendation.rank < limit)
+    results = {}
+    for subject_id, item_id, score in query.tuples():
+        results.setdefault(subject_id, {})[item_id] = score
+    return results
+
+
+def has_recommendations(subject_type: str, subject_id: int, algorithm: str):
+    return bool(get_recommendations(subject_type, subject_id, algorithm, 1))
+
+
+def get_recommended_games(
+    subject_type: str, subject_id: int, algorithm: str, limit: int = 9
+):
+    """{game: score} of the best recommendations, for showing on a page."""
+    games = (
+        Game.select(Game, Recommendation.score.alias("recommendation_score"))
+        .join(Recommendation, on=(Recommendation.item_id == Game.id))
+        .where(
+            subject_recommendations(subject_type, algorithm)
+            & (Recommendation.subject_id == subject_id)
+        )
+        .order_by(Recommendation.rank)
+        .limit(limit)
+        .objects()
+    )
+    return {game: game.recommendation_score for game in games}
+
+
+def get_similar_games(index_name: str, game_id: int, limit: int = 9):
+    """{game: score} of the games nearest to game_id in an ann index.
+
+    Approximate, pages use it when the recommendation table has no exact
+    list for the game. Empty when the index wasn't built yet.
+    """
+    index = ann.get_index(index_name)
+    if index is None:
+        return {}
+    scores = index.similar(game_id, limit)
+    games = {game.id: game for game in Game.select().where(Game.id.in_(list(scores)))}
+    return {games[id]: score for id, score in scores.items() if id in games}
+
+
+def user_recommendations_stale(user):
+    # the hybrid results are computed last, from the other algorithms
+    hr_update_time = User.select(User.hr_update_time).where(User.id == user.id).scalar()
+    return days_delta(hr_update_time) >= 1
+
+
+recommendations_cli = AppGroup(
+    "recommendations", help="Compute recommendations offline."
+)
+
+
+@recommendations_cli.command("update")
+@click.option("--user", "usernames", multiple=True, help="Only update this user.")
+@schema_required
+def update_command(usernames):
+    """Recompute stale game recommendations and those of synced users."""
+    from game_lists_site.algorithms.game import update_recommendations_for_games
+    from game_lists_site.algorithms.user import update_recommendations_for_user
+
+    update_recommendations_for_games()
+    users = User.slim().where(User.last_games_update_time.is_null(False))
+    if usernames:
+        users = users.where(User.username.in_(usernames))
+    users = list(users)
+    for done, user in enumerate(users, 1):
+        update_recommendations_for_user(user)
+        click.echo(f"updated {done}/{len(users)} {user.username}")
@@ -0,0 +1,193 @@
+import datetime as dt
+
+from peewee import EXCLUDED, ValuesList, chunked
+
+import game_lists_site.utils.steam as steam
+from game_lists_site.models import User, UserGame, db, is_postgres
+from game_lists_site.utilities import (
+    update_game_stats,
+    update_games,
+    update_playtime_aggregates,
+)
+
+BATCH_SIZE = 500
+SUMMARY_MAX_AGE = dt.timedelta(days=1)
+
+
+def upsert_user_games(user, rows):
+    """Write a library in one transaction, only touching rows that changed.
+
+    rows are dicts with game, playtime and last_played. Returns the rows that
+    were inserted or changed, with the stored values as old_playtime and
+    old_last_played (None for new rows).
+    """
+    stored = {
+        ug.game_id: (ug.playtime, ug.last_played)
+        for ug in UserGame.select(
+            UserGame.game, UserGame.playtime, UserGame.last_played
+        ).where(UserGame.user == user)
+    }
+    changed = []
+    for row in rows:
+        old = stored.get(row["game"])
+        if old != (row["playtime"], row["last_played"]):
+            old_playtime, old_last_played = old if old else (None, None)
+            changed.append(
+                {
+                    **row,
+                    "old_playtime": old_playtime,
+                    "old_last_played": old_last_played,
+                }
+            )
+    with db.atomic():
+        for batch in chunked(changed, BATCH_SIZE):
+            UserGame.insert_many(
+                [
+                    {
+                        UserGame.user: user.id,
+                        UserGame.game: row["game"],
+                        UserGame.playtime: row["playtime"],
+                        UserGame.last_played: row["last_played"],
+                    }
+                    for row in batch
+                ]
+            ).on_conflict(
+                conflict_target=[UserGame.user, UserGame.game],
+                update={
+                    UserGame.playtime: EXCLUDED.playtime,
+                    UserGame.last_played: EXCLUDED.last_played,
+                },
+            ).execute()
+    return changed
+
+
+def invalidate_recommendations(user):
+    # the next recommendations view recomputes everything for this user
+    User.update(
+        {
+            User.cbr_update_time: None,
+            User.mbcf_update_time: None,
+            User.mobcf_update_time: None,
+            User.hr_update_time: None,
+        }
+    ).where(User.id == user.id).execute()
+
+
+def sync_library(user, progress=None):
+    """Pull the user's library from steam and update what depends on it.
+
+    Only games whose playtime or last played time changed, or whose store data
+    was refreshed, go through the downstream work. progress(stage, done, total)
+    is called as the sync goes.
+    """
+    if not progress:
+        progress = lambda stage, done, total: None
+    start_time = dt.datetime.now()
+    owned_games = steam.get_owned_games(user.id) or []
+    games = update_games(
+        [owned_game["appid"] for owned_game in owned_games],
+        progress=lambda done, total: progress("fetching games", done, total),
+    )
+    # steam can answer an appid with the details of another one (a redirect
+    # or a re-release), the library links to the game that was saved
+    rows = {}
+    for owned_game in owned_games:
+        game = games.get(owned_game["appid"])
+        if not game:
+            continue
+        row = {
+            "game": game.id,
+            "playtime": owned_game["playtime_forever"],
+            "last_played": (
+                None
+                if owned_game["rtime_last_played"] == 0
+                else dt.datetime.fromtimestamp(owned_game["rtime_last_played"])
+            ),
+        }
+        # owning both appids of a redirect counts once
+        if game.id not in rows or row["playtime"] > rows[game.id]["playtime"]:
+            rows[game.id] = row
+    rows = list(rows.values())
+    games = {game.id: game for game in games.values()}
+    progress("updating library", 0, len(rows))
+    with db.atomic():
+        changed = upsert_user_games(user, rows)
+        update_playtime_aggregates(
+            (row["game"], row["old_playtime"], row["playtime"]) for row in changed
+        )
+    progress("updating library", len(rows), len(rows))
+    if changed:
+        invalidate_recommendations(user)
+    User.update({User.last_games_update_time: dt.datetime.now()}).where(
+        User.id == user.id
+    ).execute()
+    refreshed = [
+        game_id
+        for game_id, game in games.items()
+        if game.last_update_time and game.last_update_time >= start_time
+    ]
+    stats_game_ids = list(dict.fromkeys([row["game"] for row in changed] + refreshed))
+    for done, game_id in enumerate(stats_game_ids, 1):
+        progress("updating stats", done, len(stats_game_ids))
+        update_game_stats(games[game_id])
+
+
+def get_stale_summary_user_ids():
+    return [
+        id
+        for id, in User.select(User.id)
+        .where(
+            User.last_update_time.is_null()
+            | (User.last_update_time < dt.datetime.now() - SUMMARY_MAX_AGE)
+        )
+        .order_by(User.last_update_time.asc(nulls="first"))
+        .tuples()
+    ]
+
+
+def refresh_player_summaries(progress=None):
+    """Refresh avatars and profile urls of users whose summary is a day old.
+
+    Summaries are fetched 100 users per request and written with one update
+    per batch. Users steam has no summary for are marked as updated too, so
+    they are not asked for again until the next day.
+    """
+    user_ids = get_stale_summary_user_ids()
+    for done, batch in enumerate(chunked(user_ids, steam.PLAYER_SUMMARIES_BATCH), 1):
+        summaries = steam.get_player_summaries(batch)
+        now = dt.datetime.now()
+        with db.atomic():
+            User.update({User.last_update_time: now}).where(
+                User.id.in_(batch)
+            ).execute()
+            if summaries and not is_postgres():
+                # sqlite can't name the columns of a values list, and a local
+                # database doesn't mind an update per user
+                for id, summary in summaries.items():
+                    User.update(
+                        {
+                            User.avatar_url: summary["avatarfull"],
+                            User.profile_url: summary["profileurl"],
+                        }
+                    ).where(User.id == id).execute()
+            elif summaries:
+                values = ValuesList(
+                    [
+                        (id, summary["avatarfull"], summary["profileurl"])
+                        for id, summary in summaries.items()
+                    ],
+                    columns=("id", "avatar_url", "profile_url"),
+                ).alias("summary")
+                User.update(
+                    {
+                        User.avatar_url: values.c.avatar_url,
+                        User.profile_url: values.c.profile_url,
+                    }
+                ).from_(values).where(User.id == values.c.id).execute()
+        if progress:
+            progress(
+                "refreshing summaries",
+                min(done * steam.PLAYER_SUMMARIES_BATCH, len(user_ids)),
+                len(user_ids),
+            )
+    return len(user_ids)
@@ -1,9 +1,9 @@
 import datetime as dt
 
 import numpy as np
-import scipy.stats as stats
-from sklearn import preprocessing
+from peewee import chunked, fn
 
+import game_lists_site.catalog as catalog
 import game_lists_site.utils.steam as steam
 from game_lists_site.models import (
     Developer,
@@ -16,55 +16,9 @@ from game_lists_site.models import (
     Tag,
     UserGame,
     System,
+    db,
 )
 
-not_game_ids = [
-    202090,
-    205790,
-    214850,
-    217490,
-    225140,
-    226320,
-    239450,
-    250820,
-    285030,
-    310380,
-    323370,
-    36700,
-    388080,
-    404790,
-    41010,
-    413850,
-    413851,
-    413852,
-    413853,
-    413854,
-    413855,
-    413856,
-    413857,
-    413858,
-    413859,
-    431960,
-    458250,
-    458260,
-    458270,
-    458280,
-    458300,
-    458310,
-    458320,
-    497810,
-    497811,
-    497812,
-    497813,
-    585280,
-    585281,
-    585282,
-    585283,
-    607380,
-    623990,
-    700580,
-]
-
 
 class ParametersManager:
     def __init__(self, name, current_parameters, best) -> None:
@@ -112,6 +66,9 @@ def merge_dicts(dicts: list):
 
 
 def normalize_dict(dict_data: dict, coef: float = 1):
+    # only the offline algorithms use it, the web app never imports sklearn
+    from sklearn import preprocessing
+
     values = list(dict_data.values())
     values = preprocessing.normalize([values])[0] * coef
     return {k: v for k, v in zip(dict_data, values)}
@@ -130,79 +87,123 @@ def slice_dict(d, start, end):
         return {}
 
 
-developers_fix = {
-    "FromSoftware, Inc.": "FromSoftware",
-    "FromSoftware, Inc": "FromSoftware",
-    "FromSoftware Inc.": "FromSoftware",
-    "Aspyr(Linux)": "Aspyr",
-    "Aspyr(Mac)": "Aspyr",
-    "Aspyr (Mac, Linux, & Windows Update)": "Aspyr",
-    "Aspyr (Mac)": "Aspyr",
-    "Feral Interactive (Mac/Linux)": "Feral Interactive",
-    "Feral Interactive (Mac)": "Feral Interactive",
-    "Feral Interactive (Linux)": "Feral Interactive",
-    "Feral Interactive": "Feral Interactive",
-}
+def is_game_stale(game):
+    return game == None or days_delta(game.last_update_time) > 30
 
 
 def update_game(game_id: int):
-    game = Game.get_or_none(Game.id == game_id)
-    if game == None or days_delta(game.last_update_time) > 30:
+    game_id = int(game_id)
+    game_id = catalog.get_redirects([game_id]).get(game_id, game_id)
+    for attempt in range(catalog.WAIT_ATTEMPTS + 1):
+        game = Game.get_or_none(Game.id == game_id)
+        if not is_game_stale(game):
+            return game
         print("update game")
-        if game_id in not_game_ids:
-            return None
-        data = steam.get_app_details(game_id)
-        if not data:
-            return None
-        if not game:
-            game, _ = Game.get_or_create(id=data["steam_appid"])
-        game.name = data["name"]
-        game.description = data.get("about_the_game", "")
-        # get release date or none
-        if data["release_date"]["date"]:
+        reason = catalog.get_skip_reasons([game_id]).get(game_id)
+        if reason == "failed" and not game:
+            raise steam.SteamError(f"{game_id}: skipped after a failed fetch")
+        if reason:
+            return game
+        if catalog.lock_apps([game_id]):
+            break
+        if attempt == catalog.WAIT_ATTEMPTS:
+            if not game:
+                raise steam.SteamError(f"{game_id}: another sync keeps fetching it")
+            return game
+        # someone else is fetching it, use their result
+        if not catalog.wait_for_apps([game_id]):
+            # a web request serves what it has rather than hang
+            if not game:
+                raise steam.SteamError(f"{game_id}: another sync is fetching it")
+            return game
+    # the lock is held until the game is saved, so whoever waits for it
+    # finds the new data
+    try:
+        try:
+            app = steam.get_app(game_id)
+        except steam.SteamError as e:
+            # steam is throttling or down, keep serving what we already have
+            catalog.skip_app(game_id, "failed")
+            if not game:
+                raise
+            print(e)
+            return game
+        return catalog.save_game(game_id, game, app)
+    finally:
+        catalog.unlock_apps([game_id])
+
+
+def update_games(game_ids, max_workers: int = None, progress=None):
+    """Update many games at once.
+
+    Stale games are fetched from steam in parallel, apart from the ones in the
+    skipped apps cache, and written to the database one by one in the order of
+    game_ids. Games that another sync is fetching at the same time are not
+    fetched again, their result is waited for instead, up to
+    catalog.WAIT_ATTEMPTS times of catalog.WAIT_TIMEOUT seconds. Returns {game_id: game} for every game that
+    exists after the update. progress(done, total) is called after each
+    stale game. Redirected appids (see catalog.get_redirects) are looked up
+    and fetched as the game steam answers them with.
+    """
+    requested_ids = list(dict.fromkeys(game_ids))
+    redirects = catalog.get_redirects(requested_ids)
+    game_ids = list(dict.fromkeys(redirects.get(id, id) for id in requested_ids))
+    games = {game.id: game for game in Game.select().where(Game.id.in_(game_ids))}
+    stale_ids = [game_id for game_id in game_ids if is_game_stale(games.get(game_id))]
+    skipped = catalog.get_skip_reasons(stale_ids)
+    stale_ids = [game_id for game_id in stale_ids if game_id not in skipped]
+    if stale_ids:
+        print(f"update {len(stale_ids)} games, skip {len(skipped)}")
+    done, pending = 0, stale_ids
+    for attempt in range(catalog.WAIT_ATTEMPTS + 1):
+        waiting = []
+        for batch in chunked(pending, catalog.LOCK_BATCH_SIZE):
+            claimed = catalog.lock_apps(batch)
+            waiting += [game_id for game_id in batch if game_id not in claimed]
+            locked = set(claimed)
             try:
-                game.release_date = dt.datetime.strptime(
-                    data["release_date"]["date"], "%d %b, %Y"
-                ).date()
-            except:
-                game.release_date = None
-        game.image_url = data["header_image"]
-        # clear
-        q = GameDeveloper.delete().where(GameDeveloper.game == game)
-        q.execute()
-        q = GameGenre.delete().where(GameGenre.game == game)
-        q.execute()
-        q = GameTag.delete().where(GameTag.game == game)
-        q.execute()
-        for developer_name in data.get("developers", []):
-            if developer_name in developers_fix:
-                developer_name = developers_fix[developer_name]
-            developer, _ = Developer.get_or_create(name=developer_name)
-            GameDeveloper.get_or_create(game=game, developer=developer)
-        genre_blacklist = []
-        genre_blacklist.extend(range(50, 60 + 1))
-        genre_blacklist.extend(range(80, 85 + 1))
-        for genre_dict in data.get("genres", []):
-            genre, _ = Genre.get_or_create(
-                id=genre_dict["id"], name=genre_dict["description"]
-            )
-            if genre.id in genre_blacklist:
-                game.delete_instance()
-                return None
-            if genre.id == 37:
-                game.free_to_play = True
-            GameGenre.get_or_create(game=game, genre=genre)
-        for tag_name in steam.get_app_tags(game.id):
-            tag, _ = Tag.get_or_create(name=tag_name)
-            GameTag.get_or_create(game=game, tag=tag)
-        game.rating = steam.get_app_rating(game.id)
-        game.last_update_time = dt.datetime.now()
-        # save
-        game.save()
-    if game:
-        return game
-    else:
-        return None
+                for game_id, app in steam.get_apps(claimed, max_workers):
+                    if isinstance(app, steam.SteamError):
+                        print(app)
+                        catalog.skip_app(game_id, "failed")
+                    else:
+                        game = catalog.save_game(game_id, games.get(game_id), app)
+                        if game:
+                            games[game_id] = game
+                        else:
+                            games.pop(game_id, None)
+                    catalog.unlock_apps([game_id])
+                    locked.discard(game_id)
+                    done += 1
+                    if progress:
+                        progress(done, len(stale_ids))
+            finally:
+                catalog.unlock_apps(locked)
+        if not waiting:
+            break
+        if attempt == catalog.WAIT_ATTEMPTS:
+            print(f"give up on {len(waiting)} games another sync keeps fetching")
+            break
+        print(f"wait for {len(waiting)} games fetched by another sync")
+        catalog.wait_for_apps(waiting)
+        for game_id in waiting:
+            games.pop(game_id, None)
+        games.update(
+            {game.id: game for game in Game.select().where(Game.id.in_(waiting))}
+        )
+        skipped = catalog.get_skip_reasons(waiting)
+        pending = [
+            game_id
+            for game_id in waiting
+            if is_game_stale(games.get(game_id)) and game_id not in skipped
+        ]
+    if progress and stale_ids:
+        progress(len(stale_ids), len(stale_ids))
+    return {
+        game_id: games[redirects.get(game_id, game_id)]
+        for game_id in requested_ids
+        if redirects.get(game_id, game_id) in games
+    }
 
 
 def update_game_stats(game):
@@ -224,59 +225,117 @@ def update_game_stats(game):
         for tag in Tag.select(Tag.name).join(GameTag).where(GameTag.game == game)
     ]
     game.features = " ".join(features)
-    # update stats based on playtime
+    # player count, total and mean playtime are kept by update_playtime_aggregates
     users_game = UserGame.select(UserGame.id, UserGame.playtime).where(
         (UserGame.game == game) & (UserGame.playtime > 0)
     )
-    game.player_count = users_game.count()
     playtimes = np.array([ug.playtime for ug in users_game])
-    game.playtime = 0
-    game.mean_playtime = 0
     game.median_playtime = 0
     game.max_playtime = 0
     game.min_playtime = 0
     if len(playtimes) > 0:
-        game.playtime = np.sum(playtimes)
-        game.mean_playtime = np.mean(playtimes)
         game.median_playtime = np.median(playtimes)
         game.max_playtime = np.max(playtimes)
         game.min_playtime = np.min(playtimes)
-    game.save()
+    game.save(
+        only=[
+            Game.features,
+            Game.median_playtime,
+            Game.max_playtime,
+            Game.min_playtime,
+        ]
+    )
 
 
-def update_normalization(user, game):
-    print("update_normalization", user, game)
-    # game
-    if game.playtime == 0 or game.player_count < 2:
-        return
-    data = {}
-    users_game = UserGame.select(UserGame.user, UserGame.game, UserGame.playtime, UserGame.last_played).where(
-        (UserGame.game == game) & (UserGame.playtime > 0)
-    )
-    data[str(game.id)] = {
-        str(ug.user.id): {"playtime": playtime, "last_played": ug.last_played.timestamp()}
-        for ug, playtime in zip(
-            users_game,
-            preprocessing.normalize([[user_game.playtime for user_game in users_game]])[
-                0
-            ],
+def update_playtime_aggregates(changes):
+    """Apply playtime changes to the per game running aggregates.
+
+    changes are (game_id, old_playtime, new_playtime), old_playtime is None for
+    a new row. Only rows with playtime > 0 count as players, a game only owned
+    without playtime has a player_count of 0.
+    """
+    deltas = {}
+    for game_id, old, new in changes:
+        old = old or 0
+        count, total, squares = deltas.get(game_id, (0, 0, 0))
+        deltas[game_id] = (
+            count + (new > 0) - (old > 0),
+            total + new - old,
+            squares + new * new - old * old,
         )
-    }
-    game.normalization = data
-    game.save()
-    # user
-    data = user.normalization
-    if not data:
-        data = {}
-    if str(user.id) in game.normalization.get(str(game.id)):
-        data[str(game.id)] = {
-            "playtime": game.normalization.get(str(game.id)).get(str(user.id)).get("playtime"),
-            "last_played": game.normalization.get(str(game.id)).get(str(user.id)).get("last_played"),
-            "player_count": len(game.normalization.get(str(game.id)))
-        }
-    user.normalization = data
-    user.save()
+    with db.atomic():
+        unchanged = [
+            game_id
+            for game_id, (count, total, _) in deltas.items()
+            if not (count or total)
+        ]
+        for batch in chunked(unchanged, catalog.BATCH_SIZE):
+            Game.update({Game.player_count: 0}).where(
+                Game.id.in_(batch) & Game.player_count.is_null()
+            ).execute()
+        for game_id, (count, total, squares) in deltas.items():
+            if not (count or total):
+                continue
+            player_count = fn.COALESCE(Game.player_count, 0) + count
+            playtime = Game.playtime + total
+            Game.update(
+                {
+                    Game.player_count: player_count,
+                    Game.playtime: playtime,
+                    Game.playtime_square_sum: Game.playtime_square_sum + squares,
+                    Game.mean_playtime: fn.COALESCE(
+                        playtime.cast("float") / fn.NULLIF(player_count, 0), 0
+                    ),
+                }
+            ).where(Game.id == game_id).execute()
+
+
+def rebuild_playtime_aggregates():
+    """Recompute the running aggregates of every game from user_game."""
+    played = (
+        UserGame.select(
+            UserGame.game.alias("game_id"),
+            fn.COUNT(UserGame.id).alias("player_count"),
+            fn.SUM(UserGame.playtime).alias("playtime"),
+            fn.SUM(UserGame.playtime.cast("float") * UserGame.playtime).alias(
+                "playtime_square_sum"
+            ),
+        )
+        .where(UserGame.playtime > 0)
+        .group_by(UserGame.game)
+    ).alias("played")
+    with db.atomic():
+        Game.update(
+            {
+                Game.player_count: 0,
+                Game.playtime: 0,
+                Game.playtime_square_sum: 0,
+                Game.mean_playtime: 0,
+            }
+        ).execute()
+        Game.update(
+            {
+                Game.player_count: played.c.player_count,
+                Game.playtime: played.c.playtime,
+                Game.playtime_square_sum: played.c.playtime_square_sum,
+                Game.mean_playtime: played.c.playtime.cast("float")
+                / played.c.player_count,
+            }
+        ).from_(played).where(Game.id == played.c.game_id).execute()
+
+
+def normalize_playtime(playtime, game, zscore=False):
+    """Normalized playtime of one player, computed from the game aggregates.
 
+    The same values preprocessing.normalize (l2) or stats.zscore would give
+    over all players of the game.
+    """
+    if zscore:
+        mean = game.playtime / game.player_count
+        variance = max(game.playtime_square_sum / game.player_count - mean**2, 0)
+        return (playtime - mean) / variance**0.5 if variance else 0.0
+    norm = game.playtime_square_sum**0.5
+    return playtime / norm if norm else 0.0
 
 
 def update_game_score_stats(game):
@@ -296,32 +355,38 @@ def get_normalized_playtimes(user_first, **current_parameters):
         {"min_player_count": 10, "zscore": False},
     )
     system, _ = System.get_or_create(key="normalized_playtimes")
-    if days_delta(system.date_time) > 1 or p.is_diff_last_current():
+    if (
+        days_delta(system.date_time) > 1
+        or p.is_diff_last_current()
+        or system.scores is None
+    ):
         print("update normalized playtimes")
-        games = [
-            g
-            for g in Game.select(Game.id).where(
-                Game.player_count >= p["min_player_count"]
+        # also repairs any drift of the running aggregates
+        rebuild_playtime_aggregates()
+        games = {
+            game.id: game
+            for game in Game.select(
+                Game.id, Game.player_count, Game.playtime, Game.playtime_square_sum
+            ).where(Game.player_count >= p["min_player_count"])
+        }
+        users_games = (
+            UserGame.select(UserGame.user, UserGame.game, UserGame.playtime)
+            .join(Game)
+            .where(
+                (UserGame.playtime > 0) & (Game.player_count >= p["min_player_count"])
             )
-        ]
-        users_games = UserGame.select(UserGame.playtime, UserGame.user).where(
-            UserGame.playtime > 0
+            .tuples()
         )
-        result = {}
-        for game in games:
-            users_game = users_games.where(UserGame.game == game)
-            playtimes = [user_game.playtime for user_game in users_game]
-            if p["zscore"]:
-                playtimes = stats.zscore(playtimes)
-            else:
-                playtimes = preprocessing.normalize([playtimes])[0]
-            result[str(game.id)] = {
-                str(ug.user.id): playtime for ug, playtime in zip(users_game, playtimes)
-            }
-        system.json = result
+        result = {game_id: {} for game_id in games}
+        for user_id, game_id, playtime in users_games:
+            result[game_id][user_id] = normalize_playtime(
+                playtime, games[game_id], p["zscore"]
+            )
+        system.scores = result
+        system.json = None
         system.date_time = dt.datetime.now()
         system.save()
-    result = system.json
+    result = system.scores
     if user_first:
         user_first_result = {}
         for game_id in result.keys():
@@ -331,7 +396,7 @@ def get_normalized_playtimes(user_first, **current_parameters):
                 user_first_result[user_id][game_id] = result[game_id][user_id]
         return user_first_result
     else:
-        return system.json
+        return result
 
 
 def get_game_vecs(min_player_count, min_game_count):
@@ -364,5 +429,13 @@ def get_readable_result_for_games(d: dict, size: int = -1):
     if d:
         if size != -1:
             d = slice_dict(d, 1, size + 1)
-        return {Game.get_by_id(int(game_id)): value for game_id, value in d.items()}
+        games = {
+            game.id: game
+            for game in Game.select().where(Game.id.in_([int(id) for id in d]))
+        }
+        return {
+            games[int(game_id)]: value
+            for game_id, value in d.items()
+            if int(game_id) in games
+        }
     return {}
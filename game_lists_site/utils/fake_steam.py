@@ -0,0 +1,265 @@
+"""Local stand-in for the parts of the Steam web api and store the site uses.
+
+Point STEAM_API_URL and STEAM_STORE_URL at FakeSteam.url to sync against it.
+Responses are generated from the app or steam id, so the same id always gets
+the same data. Latency and a share of failed (429/5xx) responses can be
+injected, and requests are counted per endpoint.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TAGS = [
+    "Action",
+    "Adventure",
+    "Indie",
+    "RPG",
+    "Strategy",
+    "Simulation",
+    "Casual",
+    "Puzzle",
+    "Platformer",
+    "Roguelike",
+    "Open World",
+    "Story Rich",
+    "Multiplayer",
+    "Singleplayer",
+    "Atmospheric",
+    "Pixel Graphics",
+    "Sci-fi",
+    "Fantasy",
+    "Horror",
+    "Survival",
+]
+GENRES = [
+    (1, "Action"),
+    (2, "Strategy"),
+    (3, "RPG"),
+    (4, "Casual"),
+    (23, "Indie"),
+    (25, "Adventure"),
+    (28, "Simulation"),
+    (37, "Free to Play"),
+]
+DEVELOPERS = [f"Developer {i}" for i in range(50)]
+
+
+def app_ids(count: int):
+    return [10 * (i + 1) for i in range(count)]
+
+
+def app_details(app_id: int):
+    rng = random.Random(app_id)
+    return {
+        "type": "game",
+        "name": f"Game {app_id}",
+        "steam_appid": app_id,
+        "about_the_game": f"<p>Game {app_id} description.</p>",
+        "header_image": f"https://example.invalid/{app_id}/header.jpg",
+        "developers": rng.sample(DEVELOPERS, rng.randint(1, 2)),
+        "genres": [
+            {"id": str(genre_id), "description": name}
+            for genre_id, name in rng.sample(GENRES, rng.randint(1, 3))
+        ],
+        "release_date": {
+            "coming_soon": False,
+            "date": f"{rng.randint(1, 28)} Jan, {rng.randint(2000, 2022)}",
+        },
+    }
+
+
+def store_page(app_id: int):
+    rng = random.Random(app_id)
+    tags = "".join(
+        f'<a href="/tags/{tag}" class="app_tag" style="display: none;">\n\t\t\t{tag}\t\t\t</a>\n'
+        for tag in rng.sample(TAGS, rng.randint(3, 12))
+    )
+    return (
+        "<!DOCTYPE html><html><head>"
+        f"<title>Game {app_id} on Steam</title></head><body>"
+        f'<div class="game_description_snippet">Game {app_id} snippet.</div>'
+        '<div class="glance_tags popular_tags">'
+        f"{tags}</div>"
+        '<div itemprop="aggregateRating" itemscope>'
+        f'<meta itemprop="reviewCount" content="{rng.randint(10, 100000)}">'
+        f'<meta itemprop="ratingValue" content="{rng.randint(1, 10)}">'
+        '<meta itemprop="bestRating" content="10">'
+        "</div></body></html>"
+    )
+
+
+def owned_games(steam_id: int, count: int):
+    rng = random.Random(steam_id)
+    return [
+        {
+            "appid": app_id,
+            "name": f"Game {app_id}",
+            "playtime_forever": rng.choice([0, rng.randint(1, 10000)]),
+            "rtime_last_played": rng.randint(1300000000, 1660000000),
+        }
+        for app_id in app_ids(count)
+    ]
+
+
+def player_summary(steam_id: int):
+    return {
+        "steamid": str(steam_id),
+        "communityvisibilitystate": 3,
+        "profilestate": 1,
+        "personaname": f"Player {steam_id}",
+        "profileurl": f"https://steamcommunity.com/profiles/{steam_id}/",
+        "avatarfull": f"https://example.invalid/avatars/{steam_id}_full.jpg",
+        "lastlogoff": random.Random(steam_id).randint(1300000000, 1660000000),
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlparse(self.path)
+        query = {key: value[0] for key, value in parse_qs(url.query).items()}
+        endpoint = fake.count(url.path)
+        if fake.should_fail():
+            status = fake.rng.choice(fake.failure_statuses)
+            self.send_body(b"Injected failure", "text/plain", status)
+        elif endpoint == "owned_games":
+            games = owned_games(int(query["steamid"]), fake.library_size)
+            self.send_json({"response": {"game_count": len(games), "games": games}})
+        elif endpoint == "player_summaries":
+            players = [
+                player_summary(int(steam_id))
+                for steam_id in query["steamids"].split(",")
+                if steam_id
+            ]
+            self.send_json({"response": {"players": players}})
+        elif endpoint == "appdetails":
+            app_id = int(query["appids"])
+            if random.Random(app_id).random() < fake.non_game_rate:
+                # what steam answers for delisted apps and some tools
+                self.send_json({str(app_id): {"success": False}})
+            else:
+                details = app_details(app_id)
+                details["steam_appid"] = fake.redirects.get(app_id, app_id)
+                self.send_json({str(app_id): {"success": True, "data": details}})
+        elif endpoint == "store_page":
+            app_id = int(url.path.split("/")[2])
+            self.send_body(store_page(app_id).encode(), "text/html; charset=UTF-8")
+        else:
+            self.send_body(b"Not Found", "text/plain", 404)
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data).encode(), "application/json")
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200):
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status in (200, 304):
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeSteam:
+    def __init__(
+        self,
+        library_size=1500,
+        latency=0.0,
+        failure_rate=0.0,
+        failure_statuses=(429, 500, 503),
+        non_game_rate=0.0,
+        redirects=None,
+        seed=0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.library_size = library_size
+        self.latency = latency
+        # share of requests answered with one of failure_statuses
+        self.failure_rate = failure_rate
+        self.failure_statuses = failure_statuses
+        # share of appids without app details, always the same ones
+        self.non_game_rate = non_game_rate
+        # {appid: steam_appid} of apps whose details are those of another app
+        self.redirects = redirects or {}
+        self.rng = random.Random(seed)
+        self.requests = Counter()
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread = None
+
+    def count(self, path: str):
+        if path == "/IPlayerService/GetOwnedGames/v0001/":
+            endpoint = "owned_games"
+        elif path == "/ISteamUser/GetPlayerSummaries/v2/":
+            endpoint = "player_summaries"
+        elif path == "/api/appdetails":
+            endpoint = "appdetails"
+        elif path.startswith("/app/"):
+            endpoint = "store_page"
+        else:
+            endpoint = "unknown"
+        with self.lock:
+            self.requests[endpoint] += 1
+        return endpoint
+
+    def should_fail(self):
+        with self.lock:
+            if self.failure_rate and self.rng.random() < self.failure_rate:
+                self.failures += 1
+                return True
+            return False
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+            self.failures = 0
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def config(self):
+        return {
+            "STEAM_API_KEY": "fake",
+            "STEAM_API_URL": self.url,
+            "STEAM_STORE_URL": self.url,
+            "STEAM_CACHE_MODE": "off",
+            "STEAM_RATE_LIMIT": None,
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,167 @@
+"""On-disk cache for Steam responses.
+
+Entries are addressed by a hash of the request (path and params, without the
+api key), so recordings made against one host can be replayed against another.
+Each entry is a single file: a json header line followed by the raw body.
+Entries outlive their ttl to revalidate with ETag and Last-Modified, prune()
+removes the ones nobody asked for in a while.
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# seconds
+DAY = 24 * 60 * 60
+TTLS = {
+    "appdetails": 7 * DAY,
+    "store_page": 7 * DAY,
+    "player_summaries": 60 * 60,
+    "owned_games": 10 * 60,
+}
+# entries not written for this long are pruned, twice the longest ttl
+MAX_AGE = 14 * DAY
+MODES = ("off", "normal", "replay")
+IGNORED_PARAMS = {"key"}
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class CachedResponse:
+    def __init__(self, status_code: int, headers: dict, content: bytes):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get("Content-Type", "")
+        for part in content_type.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name.lower() == "charset" and value:
+                return value.strip('"')
+        return "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        directory,
+        mode: str = "normal",
+        ttls: dict = None,
+        max_age: float = MAX_AGE,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"unknown cache mode {mode!r}, expected one of {MODES}")
+        self.directory = Path(directory)
+        self.mode = mode
+        self.ttls = {**TTLS, **(ttls or {})}
+        self.max_age = max_age
+
+    def key(self, url: str, params: dict = None):
+        params = {
+            str(name): str(value)
+            for name, value in (params or {}).items()
+            if name not in IGNORED_PARAMS
+        }
+        request = json.dumps([urlparse(url).path, sorted(params.items())])
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def path(self, key: str):
+        return self.directory / key[:2] / key
+
+    def load(self, key: str):
+        try:
+            with self.path(key).open("rb") as file:
+                header, _, body = file.read().partition(b"\n")
+        except FileNotFoundError:
+            return None
+        header = json.loads(header)
+        return header, CachedResponse(header["status"], header["headers"], body)
+
+    def store(self, key: str, response, fetched: float):
+        header = {
+            "status": response.status_code,
+            "headers": {
+                name: response.headers[name]
+                for name in ("Content-Type", "ETag", "Last-Modified")
+                if name in response.headers
+            },
+            "fetched": fetched,
+        }
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{time.monotonic_ns()}")
+        with tmp_path.open("wb") as file:
+            file.write(json.dumps(header).encode())
+            file.write(b"\n")
+            file.write(response.content)
+        os.replace(tmp_path, path)
+        return CachedResponse(header["status"], header["headers"], response.content)
+
+    def prune(self):
+        """Remove entries older than max_age, returns how many.
+
+        Written time is the file mtime, a revalidated entry is written again.
+        Recordings are never pruned in replay mode.
+        """
+        if self.mode != "normal" or not self.max_age:
+            return 0
+        oldest = time.time() - self.max_age
+        removed = 0
+        # entries and the tmp files of writes that were interrupted
+        for path in self.directory.glob("??/*"):
+            try:
+                if path.stat().st_mtime < oldest:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                # written again or pruned by someone else
+                pass
+        return removed
+
+    def get(self, endpoint: str, url: str, params: dict = None, send=requests.get):
+        """GET url through the cache, send does the actual request."""
+        if self.mode == "off":
+            return send(url, params=params)
+        key = self.key(url, params)
+        entry = self.load(key)
+        if self.mode == "replay":
+            if entry is None:
+                raise CacheMiss(f"{endpoint}: {url} {params}")
+            return entry[1]
+        now = time.time()
+        headers = {}
+        if entry is not None:
+            header, cached = entry
+            if now - header["fetched"] < self.ttls.get(endpoint, 0):
+                return cached
+            if "ETag" in cached.headers:
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if "Last-Modified" in cached.headers:
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+        response = send(url, params=params, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            return self.store(key, entry[1], now)
+        if response.status_code == 200:
+            return self.store(key, response, now)
+        return response
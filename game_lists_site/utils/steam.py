@@ -1,39 +1,191 @@
 import datetime as dt
+import html
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
 
-import requests
-from bs4 import BeautifulSoup
-from flask import current_app
-from requests import get
+from flask import current_app, has_app_context, has_request_context, request, session
 from steam.steamid import SteamID
 
+from game_lists_site.models import connect_db, user_data_dir
+from game_lists_site.utils.http_cache import MAX_AGE, ResponseCache
+from game_lists_site.utils.steam_client import (
+    SharedTokenBucket,
+    SteamClient,
+    SteamError,
+)
+
+API_URL = "https://api.steampowered.com"
+STORE_URL = "https://store.steampowered.com"
+FETCH_WORKERS = 8
+# steam ids per GetPlayerSummaries call, the most steam accepts
+PLAYER_SUMMARIES_BATCH = 100
+
+default_cache = ResponseCache(user_data_dir / "steam_cache")
+default_client = SteamClient()
+# (lane, owner) of the steam requests made in this context
+current_priority = ContextVar("steam_priority", default=None)
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers share its result."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function, *args):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+app_flights = SingleFlight()
+
 
 def days_delta(datetime):
     current_date = dt.datetime.now()
     return (current_date - datetime).days
 
 
+def get_config(key, default=None):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def get_cache():
+    if not has_app_context():
+        return default_cache
+    cache = current_app.extensions.get("steam_cache")
+    if cache is None:
+        cache = ResponseCache(
+            current_app.config.get("STEAM_CACHE_DIR", user_data_dir / "steam_cache"),
+            current_app.config.get("STEAM_CACHE_MODE", "normal"),
+            current_app.config.get("STEAM_CACHE_TTLS"),
+            current_app.config.get("STEAM_CACHE_MAX_AGE", MAX_AGE),
+        )
+        cache = current_app.extensions.setdefault("steam_cache", cache)
+    return cache
+
+
+def get_client():
+    if not has_app_context():
+        return default_client
+    client = current_app.extensions.get("steam_client")
+    if client is None:
+        config = current_app.config
+        rate = config.get("STEAM_RATE_LIMIT", 4)
+        burst = config.get("STEAM_RATE_BURST", 20)
+        bucket = None
+        if rate and config.get("STEAM_RATE_SHARED", True) and "DATABASE" in config:
+            # a connection of its own, steam requests are made from threads
+            # and inside transactions
+            bucket = SharedTokenBucket(
+                connect_db(config["DATABASE"], max_connections=2), rate, burst
+            )
+        client = SteamClient(
+            rate=rate,
+            burst=burst,
+            bucket=bucket,
+            retries=config.get("STEAM_RETRIES", 5),
+            backoff=config.get("STEAM_RETRY_BACKOFF", 1),
+            pool_size=config.get("STEAM_POOL_SIZE", 32),
+        )
+        client = current_app.extensions.setdefault("steam_client", client)
+    return client
+
+
+@contextmanager
+def priority(lane: str, owner=None):
+    """Make the steam requests in this block in lane, on behalf of owner."""
+    token = current_priority.set((lane, owner))
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def get_priority():
+    value = current_priority.get()
+    if value:
+        return value
+    if has_request_context():
+        # someone is waiting for the page
+        return "interactive", session.get("user_id") or request.remote_addr
+    return "background", None
+
+
+def fetch(endpoint: str, url: str, params: dict = None):
+    lane, owner = get_priority()
+    send = partial(get_client().get, lane=lane, owner=owner)
+    return get_cache().get(endpoint, url, params, send)
+
+
+def api_url(path: str):
+    return get_config("STEAM_API_URL", API_URL) + path
+
+
+def store_url(path: str):
+    return get_config("STEAM_STORE_URL", STORE_URL) + path
+
+
 def get_steam_id_from_url(url: str):
     print("call get_steam_id_from_url")
     return SteamID.from_url(url)
 
 
+def get_player_summaries(steam_ids):
+    """{steam_id: summary} of the users, 100 per request.
+
+    Private or deleted profiles are missing from the result.
+    """
+    print("call get_player_summaries")
+    steam_ids = [str(steam_id) for steam_id in steam_ids]
+    summaries = {}
+    for start in range(0, len(steam_ids), PLAYER_SUMMARIES_BATCH):
+        players = fetch(
+            "player_summaries",
+            api_url("/ISteamUser/GetPlayerSummaries/v2/"),
+            params={
+                "key": current_app.config["STEAM_API_KEY"],
+                "steamids": ",".join(steam_ids[start : start + PLAYER_SUMMARIES_BATCH]),
+            },
+        ).json()["response"]["players"]
+        for player in players:
+            summaries[int(player["steamid"])] = player
+    return summaries
+
+
 def get_player_summary(steam_id: int):
     print("call get_player_summary")
-    r = requests.get(
-        "https://api.steampowered.com/ISteamUser/GetPlayerSummaries/v2/",
-        params={"key": current_app.config["STEAM_API_KEY"], "steamids": steam_id},
-    ).json()["response"]["players"]
-    if len(r):
-        return r[0]
-    else:
-        return None
+    return get_player_summaries([steam_id]).get(int(steam_id))
 
 
 def get_owned_games(steam_id: int):
     print("call get_owned_games")
-    response = requests.get(
-        "http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/",
-        params={
+    response = fetch(
+        "owned_games",
+        api_url("/IPlayerService/GetOwnedGames/v0001/"),
+        {
             "key": current_app.config["STEAM_API_KEY"],
             "steamid": steam_id,
             "include_appinfo": True,
@@ -45,9 +197,10 @@ def get_owned_games(steam_id: int):
 
 def get_app_details(app_id):
     print("call get_appdetails")
-    data = requests.get(
-        "https://store.steampowered.com/api/appdetails",
-        params={"appids": app_id, "l": "english"},
+    data = fetch(
+        "appdetails",
+        store_url("/api/appdetails"),
+        {"appids": app_id, "l": "english"},
     ).json()
     try:
         if "data" not in data[list(data.keys())[0]]:
@@ -58,23 +211,93 @@ def get_app_details(app_id):
     return data[list(data.keys())[0]]["data"]
 
 
+APP_TAG_RE = re.compile(
+    r'<a\b[^>]*\bclass="app_tag(?:\s[^"]*)?"[^>]*>(.*?)</a>', re.DOTALL
+)
+META_RE = re.compile(r'<meta\b[^>]*\bitemprop="[^"]*"[^>]*>')
+ATTRIBUTE_RE = re.compile(r'\b([\w-]+)="([^"]*)"')
+DESCRIPTION_RE = re.compile(
+    r'<div class="game_description_snippet"[^>]*>(.*?)</div>', re.DOTALL
+)
+
+
+def parse_store_page(text: str):
+    """Pull the fields we use out of a store page without building a DOM."""
+    meta = {}
+    for match in META_RE.finditer(text):
+        attributes = dict(ATTRIBUTE_RE.findall(match.group(0)))
+        meta.setdefault(attributes["itemprop"], attributes.get("content"))
+    description = DESCRIPTION_RE.search(text)
+
+    def to_int(value, default=0):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    return {
+        "tags": [html.unescape(tag).strip() for tag in APP_TAG_RE.findall(text)],
+        "rating": to_int(meta.get("ratingValue")),
+        "review_count": to_int(meta.get("reviewCount")),
+        "short_description": (
+            html.unescape(description.group(1)).strip() if description else ""
+        ),
+    }
+
+
+def get_store_page(app_id):
+    print("call get_store_page")
+    response = fetch("store_page", store_url(f"/app/{app_id}"))
+    return parse_store_page(response.text)
+
+
 def get_app_tags(app_id):
-    print("call get_app_tags")
-    response = get(f"https://store.steampowered.com/app/{app_id}")
-    bs = BeautifulSoup(response.text, "html.parser")
-    app_tags = bs.find_all("a", {"class": "app_tag"})
-    tags = []
-    for tag in app_tags:
-        tags.append(tag.text.strip())
-    return tags
+    return get_store_page(app_id)["tags"]
 
 
 def get_app_rating(app_id):
-    print("call get_app_rating")
-    response = get(f"https://store.steampowered.com/app/{app_id}")
-    bs = BeautifulSoup(response.text, "html.parser")
-    result = bs.find_all("meta", {"itemprop": "ratingValue"})
-    if result:
-        return int(result[0].get("content", None))
-    else:
-        return 0
+    return get_store_page(app_id)["rating"]
+
+
+def get_app(app_id):
+    # concurrent calls for the same app in this process share one fetch
+    return app_flights.do(int(app_id), fetch_app, app_id)
+
+
+def fetch_app(app_id):
+    # everything update_game needs for one app, store page only for real apps
+    details = get_app_details(app_id)
+    if not details:
+        return None
+    return {"details": details, **get_store_page(app_id)}
+
+
+def get_apps(app_ids, max_workers: int = None):
+    """Fetch apps in parallel, yield (app_id, app) in the order of app_ids.
+
+    app is what get_app returned, or the SteamError if fetching it failed.
+    """
+    app_ids = list(app_ids)
+    if max_workers is None:
+        max_workers = get_config("STEAM_FETCH_WORKERS", FETCH_WORKERS)
+    app = current_app._get_current_object() if has_app_context() else None
+    # worker threads don't inherit context variables or the request
+    lane, owner = get_priority()
+
+    def get_app_or_error(app_id):
+        # a failed app should not abort the whole batch
+        try:
+            with priority(lane, owner):
+                if app is None:
+                    return get_app(app_id)
+                with app.app_context():
+                    return get_app(app_id)
+        except SteamError as e:
+            return e
+
+    if max_workers <= 1 or len(app_ids) <= 1:
+        for app_id in app_ids:
+            yield app_id, get_app_or_error(app_id)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from zip(app_ids, executor.map(get_app_or_error, app_ids))
@@ -0,0 +1,222 @@
+"""Shared http client for everything that talks to Steam.
+
+One keep-alive session per process. The request budget is a token bucket in
+the ratelimit table, shared by the web workers, the job workers and the
+commands, or a bucket per process without a database. Waiting requests get
+tokens by priority lane, interactive before sync before background, across
+processes too.
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests
+from peewee import PostgresqlDatabase
+from requests.adapters import HTTPAdapter
+
+from game_lists_site.models import RateLimit
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# highest priority first
+LANES = ("interactive", "sync", "background")
+
+
+class SteamError(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1):
+        # rate is in tokens per second, None or 0 means no limit
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, lane: str = None):
+        """Take a token if there is one, otherwise return seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while wait := self.take():
+            time.sleep(wait)
+
+
+class SharedTokenBucket:
+    """A TokenBucket stored in the ratelimit table of database.
+
+    Every process that uses the same database and name shares the budget.
+    A process waiting in a lane marks it for lane_timeout seconds, and other
+    processes don't take tokens for lower lanes while it is marked.
+    database should be a connection of its own, a transaction of the
+    caller must not hold the row.
+    """
+
+    def __init__(self, database, rate: float, burst: int = 1, name="steam"):
+        self.database = database
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.name = name
+        # two tokens, long enough for a waiting process to ask again
+        self.lane_timeout = 2 / rate if rate else 0
+
+    def select_row(self, postgres: bool):
+        query = RateLimit.select().where(RateLimit.name == self.name)
+        if postgres:
+            query = query.for_update()
+        return query.first(self.database)
+
+    def take(self, lane: str = "background"):
+        postgres = isinstance(self.database, PostgresqlDatabase)
+        with self.database.connection_context(), (
+            self.database.atomic() if postgres else self.database.atomic("IMMEDIATE")
+        ):
+            now = time.time()
+            row = self.select_row(postgres)
+            if row is None:
+                RateLimit.insert(
+                    name=self.name, tokens=self.burst, last_refill=now
+                ).on_conflict_ignore().execute(self.database)
+                row = self.select_row(postgres)
+            tokens = min(
+                self.burst, row.tokens + max(now - row.last_refill, 0) * self.rate
+            )
+            lanes = {
+                name: until for name, until in (row.lanes or {}).items() if until > now
+            }
+            ahead = any(name in lanes for name in LANES[: LANES.index(lane)])
+            if tokens >= 1 and not ahead:
+                tokens -= 1
+                wait = 0
+            else:
+                lanes[lane] = max(lanes.get(lane, 0), now + self.lane_timeout)
+                wait = max(1 - tokens, 1 if ahead else 0) / self.rate
+            RateLimit.update(tokens=tokens, last_refill=now, lanes=lanes).where(
+                RateLimit.name == self.name
+            ).execute(self.database)
+        return wait
+
+
+class Scheduler:
+    """Hands out the tokens of a bucket by lane, round robin between owners.
+
+    A request only gets a token when no request in a higher lane is waiting.
+    Inside a lane, owners (e.g. users) of this process take turns, so one big
+    sync can't starve a small one.
+    """
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.condition = threading.Condition()
+        # lane -> {owner: waiting tickets}, owners in turn order
+        self.waiting = {lane: OrderedDict() for lane in LANES}
+
+    def head(self):
+        for queue in self.waiting.values():
+            if queue:
+                return queue[next(iter(queue))][0]
+        return None
+
+    def pop(self, lane: str, owner):
+        queue = self.waiting[lane]
+        tickets = queue[owner]
+        tickets.popleft()
+        if tickets:
+            queue.move_to_end(owner)
+        else:
+            del queue[owner]
+
+    def acquire(self, lane: str = "background", owner=None):
+        if not self.bucket.rate:
+            return
+        if lane not in self.waiting:
+            raise ValueError(f"unknown lane {lane!r}, expected one of {LANES}")
+        ticket = object()
+        with self.condition:
+            self.waiting[lane].setdefault(owner, deque()).append(ticket)
+            self.condition.notify_all()
+            while True:
+                wait = None
+                if self.head() is ticket:
+                    wait = self.bucket.take(lane)
+                    if not wait:
+                        self.pop(lane, owner)
+                        self.condition.notify_all()
+                        return
+                self.condition.wait(wait)
+
+
+class SteamClient:
+    def __init__(
+        self,
+        rate: float = 4,
+        burst: int = 20,
+        retries: int = 5,
+        backoff: float = 1,
+        max_backoff: float = 60,
+        pool_size: int = 32,
+        timeout: float = 30,
+        bucket=None,
+    ):
+        self.limiter = bucket or TokenBucket(rate, burst)
+        self.scheduler = Scheduler(self.limiter)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def delay(self, attempt: int, response):
+        retry_after = (
+            response.headers.get("Retry-After") if response is not None else None
+        )
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.max_backoff)
+        delay = min(self.backoff * 2**attempt, self.max_backoff)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def get(
+        self,
+        url: str,
+        params: dict = None,
+        headers: dict = None,
+        lane: str = "background",
+        owner=None,
+    ):
+        """GET with rate limiting and exponential backoff on 429 and 5xx.
+
+        lane and owner decide who gets the next token, see Scheduler.
+        """
+        for attempt in range(self.retries + 1):
+            self.scheduler.acquire(lane, owner)
+            response, error = None, None
+            try:
+                response = self.session.get(
+                    url, params=params, headers=headers, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = f"status {response.status_code}"
+            if attempt < self.retries:
+                delay = self.delay(attempt, response)
+                print(f"steam {url}: {error}, retry in {delay:.1f}s")
+                time.sleep(delay)
+        raise SteamError(f"{url}: {error} after {self.retries + 1} attempts")
@@ -17,6 +17,7 @@ from game_lists_site.models import (
     Developer,
     Game,
     GameCBR,
+    GameDescription,
     GameDeveloper,
     GameGenre,
     GameMBCF,
@@ -48,7 +49,6 @@ def get_game(game_id: int):
             return None
         if not game:
             game, _ = Game.get_or_create(id=data["steam_appid"], name=data["name"])
-        game.description = data.get("about_the_game", "")
         if data["release_date"]["date"]:
             try:
                 game.release_date = dt.datetime.strptime(
@@ -80,12 +80,19 @@ def get_game(game_id: int):
             if genre.id == 37:
                 game.free_to_play = True
             GameGenre.get_or_create(game=game, genre=genre)
-        for tag_name in steam.get_app_tags(game.id):
+        store_page = steam.get_store_page(game.id)
+        for tag_name in store_page["tags"]:
             tag, _ = Tag.get_or_create(name=tag_name)
             GameTag.get_or_create(game=game, tag=tag)
-        game.rating = steam.get_app_rating(game.id)
+        game.rating = store_page["rating"]
         game.last_update_time = dt.datetime.now()
         game.save()
+        GameDescription.insert(
+            game=game, description=data.get("about_the_game", "")
+        ).on_conflict(
+            conflict_target=[GameDescription.game],
+            preserve=[GameDescription.description],
+        ).execute()
     return game
 
 
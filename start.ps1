@@ -1,3 +1,10 @@
-Set-Variable FLASK_APP=game_lists_site
-Set-Variable FLASK_DEBUG=True
-flask run
+$env:FLASK_APP = "game_lists_site"
+$env:FLASK_DEBUG = "True"
+flask db upgrade
+$worker = Start-Process flask -ArgumentList "worker" -NoNewWindow -PassThru
+try {
+    flask run
+}
+finally {
+    Stop-Process -Id $worker.Id -ErrorAction SilentlyContinue
+}
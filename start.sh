@@ -1,4 +1,6 @@
 #!/bin/sh
 export FLASK_APP=game_lists_site
 export FLASK_DEBUG=true
+flask db upgrade
+flask worker &
 flask run
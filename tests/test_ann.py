@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from flask import Flask
+
+import game_lists_site.ann as ann
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config["ANN_INDEX_DIR"] = str(tmp_path)
+    with app.app_context():
+        yield app
+
+
+def vectors(seed):
+    return np.random.default_rng(seed).standard_normal((50, 8))
+
+
+def test_save_index_keeps_the_previous_build(app, tmp_path):
+    for seed in range(3):
+        ann.save_index("games", np.arange(50), vectors(seed))
+    builds = sorted(path.name for path in tmp_path.glob("games.*[0-9]"))
+    assert len(builds) == ann.KEEP_BUILDS
+    assert (tmp_path / "games.current").read_text() == builds[-1]
+
+
+def test_save_index_without_vectors(app):
+    ann.save_index("games", np.arange(50), vectors(0))
+    assert ann.save_index("games", np.arange(0), np.zeros((0, 8))) is None
+    assert ann.get_index("games") is None
+
+
+def test_get_index_retries_when_the_build_is_removed(app, tmp_path, monkeypatch):
+    ann.save_index("games", np.arange(50), vectors(0))
+    load = ann.AnnIndex.load
+
+    def load_removed_once(path):
+        # a newer build swapped the pointer and removed this one meanwhile
+        monkeypatch.setattr(ann.AnnIndex, "load", load)
+        ann.save_index("games", np.arange(50), vectors(1))
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(ann.AnnIndex, "load", load_removed_once)
+    index = ann.get_index("games")
+    assert np.allclose(index.vectors[index.rows[0]], ann.normalize(vectors(1))[0])
+
+
+def test_similar_finds_the_exact_neighbours_with_every_list_probed():
+    data = vectors(0)
+    index = ann.AnnIndex.build(np.arange(50) * 10, data)
+    similarities = ann.normalize(data) @ ann.normalize(data)[3]
+    similarities[3] = -np.inf
+    expected = (np.argsort(-similarities)[:5] * 10).tolist()
+    assert list(index.similar(30, 5, probes=len(index.centroids))) == expected
@@ -0,0 +1,175 @@
+import datetime as dt
+import json
+
+import pytest
+
+import game_lists_site.catalog as catalog
+import game_lists_site.migrations as migrations
+from game_lists_site import create_app
+from game_lists_site.models import Developer, Game, GameTag, Genre, Tag, db
+from game_lists_site.utils.fake_steam import FakeSteam, app_details
+
+
+@pytest.fixture
+def fake_steam():
+    with FakeSteam() as fake:
+        yield fake
+
+
+@pytest.fixture
+def app(tmp_path, fake_steam):
+    app = create_app(
+        {
+            "SECRET_KEY": "test",
+            "DATABASE": str(tmp_path / "test.sqlite"),
+            **fake_steam.config(),
+        }
+    )
+    # the cached developer and tag ids are those of another test's database
+    catalog.clear_caches()
+    with app.app_context(), db.connection_context():
+        migrations.upgrade()
+        yield app
+
+
+def test_refresh_catalog_leaves_out_skipped_apps(app, fake_steam):
+    for game_id in (10, 20, 30):
+        Game.create(id=game_id)
+    catalog.skip_app(20, "no_details")
+    counts = catalog.refresh_catalog([10, 20, 30], max_workers=2)
+    assert counts["refreshed"] == 2
+    assert counts["skipped"] == 1
+    assert fake_steam.requests["appdetails"] == 2
+
+
+def test_write_links_applies_the_difference(app):
+    Game.insert_many([{"id": 1}, {"id": 2}]).execute()
+    Genre.insert_many([{"id": 1, "name": "Action"}]).execute()
+    tags = [Tag.create(name=name).id for name in ("Indie", "RPG", "Puzzle")]
+    developer = Developer.create(name="Developer").id
+    catalog.write_links(
+        {
+            (1, "tag"): {tags[0], tags[1]},
+            (1, "genre"): {1},
+            (2, "tag"): {tags[0]},
+            (2, "developer"): {developer},
+        },
+        {},
+    )
+    links = catalog.get_links([1, 2])
+    assert links == {
+        (1, "tag"): {tags[0], tags[1]},
+        (1, "genre"): {1},
+        (2, "tag"): {tags[0]},
+        (2, "developer"): {developer},
+    }
+    # kinds missing from links are left alone
+    catalog.write_links({(1, "tag"): {tags[1], tags[2]}, (2, "tag"): set()}, links)
+    assert catalog.get_links([1, 2]) == {
+        (1, "tag"): {tags[1], tags[2]},
+        (1, "genre"): {1},
+        (2, "developer"): {developer},
+    }
+
+
+def test_save_games_replaces_the_links_of_a_game(app):
+    app_data = {
+        "details": {
+            "steam_appid": 10,
+            "name": "Game 10",
+            "developers": ["Developer"],
+            "genres": [{"id": "1", "description": "Action"}],
+        },
+        "tags": ["Indie", "RPG"],
+        "rating": 8,
+    }
+    catalog.save_games([catalog.parse_app(app_data)])
+    app_data["tags"] = ["RPG", "Puzzle"]
+    app_data["details"]["developers"] = ["Feral Interactive (Mac)"]
+    catalog.save_games([catalog.parse_app(app_data)])
+    names = {
+        kind: {model.get_by_id(id).name for id in ids}
+        for (_, kind), ids in catalog.get_links([10]).items()
+        for model in [{"tag": Tag, "genre": Genre, "developer": Developer}[kind]]
+    }
+    assert names == {
+        "tag": {"RPG", "Puzzle"},
+        "genre": {"Action"},
+        "developer": {"Feral Interactive"},
+    }
+
+
+def details(app_id, **fields):
+    # a genre that is kept, the fake ones are random
+    return {
+        **app_details(app_id),
+        "genres": [{"id": "1", "description": "Action"}],
+        **fields,
+    }
+
+
+def write(path, records, ndjson=False):
+    with open(path, "w", encoding="utf-8") as file:
+        if ndjson:
+            file.writelines(json.dumps(record) + "\n" for record in records)
+        else:
+            json.dump(records, file)
+    return path
+
+
+def test_read_dump_of_appdetails_answers_by_appid(tmp_path):
+    path = write(
+        tmp_path / "apps.json",
+        {
+            "10": {"success": True, "data": details(10)},
+            "20": {"success": False},
+        },
+    )
+    assert list(catalog.read_dump(path)) == [
+        (10, {"details": details(10), "tags": [], "rating": 0}),
+        (20, None),
+    ]
+
+
+def test_read_dump_of_bare_details_and_app_shapes(tmp_path):
+    bare = write(
+        tmp_path / "apps.ndjson",
+        [details(10, tags=["Indie"], rating=7), details(20)],
+        ndjson=True,
+    )
+    assert list(catalog.read_dump(bare)) == [
+        (10, {"details": details(10), "tags": ["Indie"], "rating": 7}),
+        (20, {"details": details(20), "tags": [], "rating": 0}),
+    ]
+    app = {"details": details(30), "tags": ["RPG"], "rating": 5}
+    assert list(catalog.read_dump(write(tmp_path / "app.json", app))) == [(30, app)]
+    assert list(catalog.read_dump(write(tmp_path / "list.json", [app]))) == [(30, app)]
+
+
+def test_import_dump(app, tmp_path):
+    catalog.skip_app(40, "legacy")
+    blacklisted = details(30, genres=[{"id": "50", "description": "Tool"}])
+    path = write(
+        tmp_path / "apps.json",
+        {
+            "10": {"success": True, "data": details(10, tags=["Indie", "RPG"])},
+            "20": {"success": False},
+            "30": {"success": True, "data": blacklisted},
+            "40": {"success": True, "data": details(40)},
+        },
+    )
+    start = dt.datetime.now()
+    counts = catalog.import_dump(path, spread=False)
+    assert counts == {"imported": 1, "skipped": 1, "removed": 2}
+    game = Game.get_by_id(10)
+    assert game.name == "Game 10"
+    assert game.last_update_time >= start
+    assert {name for name, in Tag.select(Tag.name).join(GameTag).tuples()} == {
+        "Indie",
+        "RPG",
+    }
+    assert catalog.get_skip_reasons([10, 20, 30, 40]) == {
+        20: "no_details",
+        30: "blacklisted_genre",
+        40: "legacy",
+    }
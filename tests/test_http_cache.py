@@ -0,0 +1,29 @@
+import os
+import time
+
+from game_lists_site.utils.http_cache import DAY, CachedResponse, ResponseCache
+
+
+def store(cache, url, age):
+    key = cache.key(url)
+    cache.store(key, CachedResponse(200, {}, b"{}"), time.time() - age)
+    path = cache.path(key)
+    os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+
+def test_prune_removes_old_entries(tmp_path):
+    cache = ResponseCache(tmp_path, max_age=14 * DAY)
+    old = store(cache, "https://store.steampowered.com/app/10", 20 * DAY)
+    expired = store(cache, "https://store.steampowered.com/app/20", 8 * DAY)
+    assert cache.prune() == 1
+    assert not old.exists()
+    assert expired.exists()
+
+
+def test_prune_keeps_recordings(tmp_path):
+    old = store(
+        ResponseCache(tmp_path), "https://store.steampowered.com/app/10", 20 * DAY
+    )
+    assert ResponseCache(tmp_path, "replay").prune() == 0
+    assert old.exists()
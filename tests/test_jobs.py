@@ -0,0 +1,79 @@
+import datetime as dt
+import time
+
+import pytest
+from peewee import IntegrityError
+
+import game_lists_site.jobs as jobs
+import game_lists_site.migrations as migrations
+from game_lists_site import create_app
+from game_lists_site.models import Job, User, db
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({"SECRET_KEY": "test", "DATABASE": str(tmp_path / "test.sqlite")})
+    with app.app_context(), db.connection_context():
+        migrations.upgrade()
+        yield app
+
+
+def running_job(kind, started, heartbeat):
+    now = dt.datetime.now()
+    return Job.create(
+        kind=kind,
+        status="running",
+        started_time=now - started,
+        heartbeat_time=heartbeat and now - heartbeat,
+    )
+
+
+def test_requeue_stale_jobs_goes_by_heartbeat(app):
+    hour = dt.timedelta(hours=1)
+    long_running = running_job(
+        "long", started=2 * hour, heartbeat=dt.timedelta(seconds=1)
+    )
+    dead = running_job("dead", started=2 * hour, heartbeat=hour)
+    from_before_heartbeats = running_job("old", started=2 * hour, heartbeat=None)
+    assert jobs.requeue_stale_jobs() == 2
+    statuses = {job.id: job.status for job in Job.select()}
+    assert statuses == {
+        long_running.id: "running",
+        dead.id: "queued",
+        from_before_heartbeats.id: "queued",
+    }
+
+
+def test_run_job_beats_while_the_job_runs(app, monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL", 0.05)
+    monkeypatch.setitem(jobs.handlers, "sleep", lambda job: time.sleep(0.3))
+    Job.create(kind="sleep")
+    job = jobs.claim_job()
+    claimed_heartbeat = job.heartbeat_time
+    jobs.run_job(job)
+    job = Job.get_by_id(job.id)
+    assert job.status == "done"
+    assert job.heartbeat_time > claimed_heartbeat
+
+
+def test_enqueue_keeps_one_active_job(app):
+    user = User.create(id=1, username="user", password="")
+    job = jobs.enqueue("sync_library", user)
+    assert jobs.enqueue("sync_library", user).id == job.id
+    assert jobs.enqueue("refresh_player_summaries").id != job.id
+    # what two enqueues that both saw no active job would do
+    with pytest.raises(IntegrityError), db.atomic():
+        Job.create(kind="sync_library", user=user)
+    with pytest.raises(IntegrityError), db.atomic():
+        Job.create(kind="refresh_player_summaries")
+    Job.update(status="done").where(Job.id == job.id).execute()
+    assert jobs.enqueue("sync_library", user).id != job.id
+
+
+def test_pages_work_after_an_upgrade(tmp_path):
+    app = create_app({"SECRET_KEY": "test", "DATABASE": str(tmp_path / "test.sqlite")})
+    client = app.test_client()
+    assert client.get("/missing").status_code == 503
+    with app.app_context(), db.connection_context():
+        migrations.upgrade()
+    assert client.get("/missing").status_code == 404
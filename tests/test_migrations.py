@@ -0,0 +1,30 @@
+import game_lists_site.migrations as migrations
+from game_lists_site.catalog import legacy_skipped_ids
+from game_lists_site.models import Job, SchemaVersion, SkippedApp, connect_db, db
+
+
+def test_upgrade_skips_the_legacy_appids(tmp_path):
+    db.initialize(connect_db(str(tmp_path / "test.sqlite")))
+    with db.connection_context():
+        migrations.upgrade()
+        assert migrations.check_schema() is None
+        skipped = {
+            id: (reason, expires_time)
+            for id, reason, expires_time in SkippedApp.select(
+                SkippedApp.id, SkippedApp.reason, SkippedApp.expires_time
+            ).tuples()
+        }
+    assert skipped == {id: ("legacy", None) for id in legacy_skipped_ids}
+
+
+def test_active_job_duplicates_fail_before_the_index(tmp_path):
+    db.initialize(connect_db(str(tmp_path / "test.sqlite")))
+    with db.connection_context():
+        migrations.upgrade()
+        # a database at version 10, before the index
+        db.execute_sql("DROP INDEX job_active")
+        SchemaVersion.delete().where(SchemaVersion.version >= 11).execute()
+        first, second = Job.create(kind="sync"), Job.create(kind="sync")
+        assert 11 in migrations.upgrade()
+        statuses = {job.id: job.status for job in Job.select()}
+    assert statuses == {first.id: "queued", second.id: "failed"}
@@ -0,0 +1,75 @@
+import math
+
+import pytest
+
+import game_lists_site.migrations as migrations
+from game_lists_site.models import (
+    JsonCodec,
+    OrjsonCodec,
+    Parameters,
+    System,
+    connect_db,
+    db,
+    pack_scores,
+    unpack_scores,
+)
+
+VALUE = {"name": "cbr", "best": {"min_player_count": 10, "coef": 0.75}, "ids": [1, 2]}
+
+
+@pytest.fixture
+def database(tmp_path):
+    db.initialize(connect_db(str(tmp_path / "test.sqlite")))
+    with db.connection_context():
+        migrations.upgrade()
+        yield
+
+
+@pytest.mark.parametrize("scores", [{10: 0.5}, {10: {20: 0.5, 30: -1.25}}])
+def test_pack_scores_round_trip(scores):
+    assert unpack_scores(pack_scores(scores)) == scores
+
+
+def test_pack_scores_keeps_ids_and_scores_exact():
+    scores = {2**40 + i: {-i: i / 3, 2**62: math.pi} for i in range(100)}
+    scores[7] = {}
+    assert unpack_scores(pack_scores(scores)) == scores
+    flat = {i: i / 7 for i in range(1000)}
+    assert unpack_scores(pack_scores(flat)) == flat
+    # an int64 id and a float64 score each, after the header
+    assert len(pack_scores(flat)) == 9 + 1000 * 16
+
+
+@pytest.mark.parametrize("codec", ["json", "orjson"])
+def test_codec_round_trip(codec):
+    if codec == "orjson":
+        pytest.importorskip("orjson")
+    codec = OrjsonCodec() if codec == "orjson" else JsonCodec()
+    assert codec.loads(codec.dumps(VALUE)) == VALUE
+    # non string keys come back as strings, as with the stdlib
+    assert codec.loads(codec.dumps({1: "a"})) == {"1": "a"}
+    # past int64, orjson hands it to the stdlib
+    assert codec.loads(codec.dumps({"big": 2**70})) == {"big": 2**70}
+
+
+def test_codecs_differ_on_nan():
+    pytest.importorskip("orjson")
+    with pytest.raises(ValueError):
+        JsonCodec().dumps({"score": float("nan")})
+    assert OrjsonCodec().loads(OrjsonCodec().dumps({"score": float("nan")})) == {
+        "score": None
+    }
+    # what one codec writes the other reads
+    assert JsonCodec().loads(OrjsonCodec().dumps(VALUE)) == VALUE
+    assert OrjsonCodec().loads(JsonCodec().dumps(VALUE)) == VALUE
+
+
+def test_fields_round_trip(database):
+    Parameters.create(name="cbr", best=VALUE, last={})
+    parameters = Parameters.get_by_id("cbr")
+    assert parameters.best == VALUE
+    # empty values are stored as null
+    assert parameters.last is None
+    scores = {10: {20: 0.5}, 30: {}}
+    System.create(key="normalized_playtimes", scores=scores)
+    assert System.get(System.key == "normalized_playtimes").scores == scores
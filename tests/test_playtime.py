@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from scipy import stats
+from sklearn import preprocessing
+
+import game_lists_site.migrations as migrations
+from game_lists_site.models import Game, User, UserGame, connect_db, db
+from game_lists_site.sync import upsert_user_games
+from game_lists_site.utilities import (
+    normalize_playtime,
+    rebuild_playtime_aggregates,
+    update_playtime_aggregates,
+)
+
+AGGREGATES = ["player_count", "playtime", "playtime_square_sum", "mean_playtime"]
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path):
+    db.initialize(connect_db(str(tmp_path / "test.sqlite")))
+    with db.connection_context():
+        migrations.upgrade()
+        yield
+
+
+def sync(user, playtimes):
+    """Write {game_id: playtime} as the library of user the way a sync does."""
+    changed = upsert_user_games(
+        user,
+        [
+            {"game": game_id, "playtime": playtime, "last_played": None}
+            for game_id, playtime in playtimes.items()
+        ],
+    )
+    update_playtime_aggregates(
+        (row["game"], row["old_playtime"], row["playtime"]) for row in changed
+    )
+
+
+def aggregates():
+    return {
+        game.id: tuple(getattr(game, name) for name in AGGREGATES)
+        for game in Game.select().order_by(Game.id)
+    }
+
+
+def test_running_aggregates_match_a_rebuild():
+    for game_id in (10, 20, 30):
+        Game.create(id=game_id)
+    users = [
+        User.create(id=id, username=f"user{id}", password="") for id in range(1, 4)
+    ]
+    sync(users[0], {10: 100, 20: 0})
+    sync(users[1], {10: 50, 20: 30})
+    sync(users[2], {10: 7})
+    # played more, stopped playing and removed nothing
+    sync(users[0], {10: 150, 20: 0})
+    sync(users[1], {10: 0, 20: 30})
+    running = aggregates()
+    assert running[10] == (2, 157, 150**2 + 7**2, 78.5)
+    assert running[20] == (1, 30, 900, 30)
+    # nobody owns it yet
+    assert running[30] == (None, 0, 0, 0)
+    rebuild_playtime_aggregates()
+    rebuilt = aggregates()
+    assert rebuilt[10] == running[10]
+    assert rebuilt[20] == running[20]
+
+
+def test_owned_without_playtime_has_no_players():
+    Game.create(id=10)
+    sync(User.create(id=1, username="user", password=""), {10: 0})
+    assert Game.get_by_id(10).player_count == 0
+
+
+def test_normalize_playtime_matches_the_whole_column():
+    playtimes = np.array([10, 200, 35, 4000, 1])
+    game = Game(
+        player_count=len(playtimes),
+        playtime=int(playtimes.sum()),
+        playtime_square_sum=float((playtimes.astype(float) ** 2).sum()),
+    )
+    l2 = preprocessing.normalize([playtimes])[0]
+    zscores = stats.zscore(playtimes)
+    for playtime, expected_l2, expected_zscore in zip(playtimes, l2, zscores):
+        assert normalize_playtime(playtime, game) == pytest.approx(expected_l2)
+        assert normalize_playtime(playtime, game, zscore=True) == pytest.approx(
+            expected_zscore
+        )
+
+
+def test_normalize_playtime_of_a_single_player():
+    game = Game(player_count=1, playtime=60, playtime_square_sum=3600.0)
+    assert normalize_playtime(60, game) == 1.0
+    assert normalize_playtime(60, game, zscore=True) == 0.0
@@ -0,0 +1,51 @@
+import pytest
+
+import game_lists_site.migrations as migrations
+import game_lists_site.recommendations as recommendations
+from game_lists_site.models import connect_db, db
+from game_lists_site.recommendations import (
+    get_all_recommendations,
+    save_recommendations,
+)
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+    # several chunks of subjects even for a small test
+    monkeypatch.setattr(recommendations, "INSERT_ROWS", 10)
+    db.initialize(connect_db(str(tmp_path / "test.sqlite")))
+    with db.connection_context():
+        migrations.upgrade()
+        yield
+
+
+def results(subject_ids, offset=0):
+    return (
+        (subject_id, {subject_id + 1: 1.0 + offset, subject_id + 2: 0.5 + offset})
+        for subject_id in subject_ids
+    )
+
+
+def test_save_recommendations_in_chunks():
+    save_recommendations("game", "cbr", results(range(2000)))
+    saved = get_all_recommendations("game", "cbr")
+    assert len(saved) == 2000
+    assert saved[7] == {8: 1.0, 9: 0.5}
+    assert list(saved[7]) == [8, 9]
+
+
+def test_save_recommendations_replaces_only_its_subjects():
+    save_recommendations("game", "cbr", results(range(10)))
+    save_recommendations("game", "cbr", results(range(5, 15), offset=1))
+    saved = get_all_recommendations("game", "cbr")
+    assert sorted(saved) == list(range(15))
+    assert saved[0] == {1: 1.0, 2: 0.5}
+    assert saved[5] == {6: 2.0, 7: 1.5}
+
+
+def test_save_recommendations_replace_all():
+    save_recommendations("game", "cbr", results(range(10)))
+    save_recommendations("game", "mbcf", results(range(10)))
+    save_recommendations("game", "cbr", results(range(5, 15)), replace_all=True)
+    assert sorted(get_all_recommendations("game", "cbr")) == list(range(5, 15))
+    assert len(get_all_recommendations("game", "mbcf")) == 10
@@ -0,0 +1,26 @@
+import numpy as np
+from scipy import sparse
+
+from game_lists_site.algorithms.game import top_k_cosine
+
+
+def test_top_k_cosine_of_centered_rows_is_the_top_correlation():
+    vectors = np.random.default_rng(0).random((40, 12)).astype(np.float32)
+    correlations = np.corrcoef(vectors)
+    np.fill_diagonal(correlations, -np.inf)
+    centered = vectors - vectors.mean(axis=1, keepdims=True)
+    # small blocks, so rows are split over several of them
+    for row, columns, scores in top_k_cosine(centered, 5, block_bytes=2000):
+        expected = np.argsort(-correlations[row])[:5]
+        expected = expected[correlations[row, expected] > 0]
+        assert columns.tolist() == expected.tolist()
+        assert np.allclose(scores, correlations[row, expected], atol=1e-5)
+
+
+def test_top_k_cosine_sparse_and_dense_agree():
+    counts = np.random.default_rng(1).integers(0, 2, (30, 20))
+    dense = list(top_k_cosine(counts.astype(float), 4))
+    for (_, _, scores), (_, _, dense_scores) in zip(
+        top_k_cosine(sparse.csr_matrix(counts), 4), dense
+    ):
+        assert np.allclose(scores, dense_scores)
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from game_lists_site.migrations import upgrade
+from game_lists_site.models import connect_db, db
+from game_lists_site.utils.steam_client import Scheduler, SharedTokenBucket
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    url = str(tmp_path / "test.sqlite")
+    db.initialize(connect_db(url))
+    with db.connection_context():
+        upgrade()
+    return url
+
+
+def test_shared_bucket_budget_is_shared(database_url):
+    # two processes, each with its own connection
+    first = SharedTokenBucket(connect_db(database_url), rate=1, burst=2)
+    second = SharedTokenBucket(connect_db(database_url), rate=1, burst=2)
+    assert first.take() == 0
+    assert second.take() == 0
+    assert first.take() > 0
+    assert second.take() > 0
+
+
+def test_shared_bucket_waiting_lane_holds_back_lower_lanes(database_url):
+    web = SharedTokenBucket(connect_db(database_url), rate=1, burst=1)
+    refresh = SharedTokenBucket(connect_db(database_url), rate=1, burst=1)
+    assert refresh.take("background") == 0
+    # a page request waits for the next token, the refresh must let it go first
+    assert web.take("interactive") > 0
+    refresh.database.execute_sql("UPDATE ratelimit SET tokens = 1")
+    assert refresh.take("background") > 0
+    assert web.take("interactive") == 0
+
+
+class ManualBucket:
+    """Tokens only come when the test hands them out."""
+
+    rate = 1
+
+    def __init__(self):
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def take(self, lane=None):
+        with self.lock:
+            if self.tokens:
+                self.tokens -= 1
+                return 0
+            return 0.01
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_scheduler_orders_lanes_and_takes_turns_between_owners():
+    bucket = ManualBucket()
+    scheduler = Scheduler(bucket)
+    order = []
+    requests = [
+        ("background", None),
+        ("sync", "big"),
+        ("sync", "big"),
+        ("sync", "big"),
+        ("sync", "small"),
+        ("background", None),
+        ("interactive", "page"),
+    ]
+    for queued, (lane, owner) in enumerate(requests, 1):
+
+        def request(lane=lane, owner=owner):
+            scheduler.acquire(lane, owner)
+            order.append((lane, owner))
+
+        threading.Thread(target=request, daemon=True).start()
+        wait_until(
+            lambda: sum(
+                len(tickets)
+                for queue in scheduler.waiting.values()
+                for tickets in queue.values()
+            )
+            == queued
+        )
+    for granted in range(1, len(requests) + 1):
+        bucket.tokens = 1
+        wait_until(lambda: len(order) == granted)
+    assert order == [
+        ("interactive", "page"),
+        ("sync", "big"),
+        ("sync", "small"),
+        ("sync", "big"),
+        ("sync", "big"),
+        ("background", None),
+        ("background", None),
+    ]
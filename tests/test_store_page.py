@@ -0,0 +1,54 @@
+import random
+
+from game_lists_site.utils.fake_steam import TAGS, store_page
+from game_lists_site.utils.steam import parse_store_page
+
+PAGE = """<!DOCTYPE html><html><head><title>Game on Steam</title>
+<meta itemprop="name" content="Game"></head><body>
+<div class="game_description_snippet">
+    Build &amp; defend a colony.
+</div>
+<div class="glance_tags popular_tags" data-appid="10">
+<a href="/tags/en/Strategy/" class="app_tag" style="display: none;">
+    Strategy                                                </a>
+<a href="/tags/en/Base%20Building/" class="app_tag">
+    Base Building                                                </a>
+<a href="/tags/en/Sci-fi/" class="app_tag">
+    Sci-fi &amp; Space                                                </a>
+<div class="app_tag add_button" onclick="ShowAppTagModal(10)">+</div>
+</div>
+<div itemprop="aggregateRating" itemscope itemtype="http://schema.org/AggregateRating">
+<meta content="9" itemprop="ratingValue">
+<meta itemprop="reviewCount" content="12345">
+<meta itemprop="bestRating" content="10">
+</div>
+</body></html>"""
+
+
+def test_parse_store_page():
+    assert parse_store_page(PAGE) == {
+        "tags": ["Strategy", "Base Building", "Sci-fi & Space"],
+        "rating": 9,
+        "review_count": 12345,
+        "short_description": "Build & defend a colony.",
+    }
+
+
+def test_parse_store_page_without_the_fields():
+    # e.g. the age check page steam shows instead of some store pages
+    page = "<html><body><div class='agegate'>Please enter your birth date</div>"
+    assert parse_store_page(page) == {
+        "tags": [],
+        "rating": 0,
+        "review_count": 0,
+        "short_description": "",
+    }
+
+
+def test_parse_store_page_of_fake_steam():
+    parsed = parse_store_page(store_page(10))
+    rng = random.Random(10)
+    assert parsed["tags"] == rng.sample(TAGS, rng.randint(3, 12))
+    assert parsed["review_count"] == rng.randint(10, 100000)
+    assert parsed["rating"] == rng.randint(1, 10)
+    assert parsed["short_description"] == "Game 10 snippet."
@@ -0,0 +1,144 @@
+import datetime as dt
+
+import pytest
+
+import game_lists_site.catalog as catalog
+import game_lists_site.migrations as migrations
+from game_lists_site import create_app
+from game_lists_site.models import AppRedirect, Game, User, UserGame, db
+import game_lists_site.sync as sync
+from game_lists_site.sync import sync_library, upsert_user_games
+from game_lists_site.utils.fake_steam import FakeSteam
+
+STEAM_ID = 76561197960287930
+
+
+@pytest.fixture
+def fake_steam():
+    # appid 20 answers with the details of appid 25, like a re-release
+    with FakeSteam(library_size=3, redirects={20: 25}) as fake:
+        yield fake
+
+
+@pytest.fixture
+def app(tmp_path, fake_steam):
+    app = create_app(
+        {
+            "SECRET_KEY": "test",
+            "DATABASE": str(tmp_path / "test.sqlite"),
+            "ANN_INDEX_DIR": str(tmp_path / "ann"),
+            **fake_steam.config(),
+        }
+    )
+    # the cached developer and tag ids are those of another test's database
+    catalog.clear_caches()
+    with app.app_context(), db.connection_context():
+        migrations.upgrade()
+        yield app
+
+
+def test_sync_library_with_redirected_appid(app):
+    user = User.create(id=STEAM_ID, username="player", password="x")
+    sync_library(user)
+    assert sorted(id for id, in Game.select(Game.id).tuples()) == [10, 25, 30]
+    assert sorted(
+        game_id
+        for game_id, in UserGame.select(UserGame.game)
+        .where(UserGame.user == user)
+        .tuples()
+    ) == [10, 25, 30]
+
+
+def test_redirected_appid_is_not_fetched_again(app, fake_steam):
+    user = User.create(id=STEAM_ID, username="player", password="x")
+    sync_library(user)
+    assert dict(AppRedirect.select(AppRedirect.id, AppRedirect.game).tuples()) == {
+        20: 25
+    }
+    fake_steam.reset_counts()
+    sync_library(user)
+    assert fake_steam.requests["appdetails"] == 0
+    response = app.test_client().get("/game/20/Game%2020")
+    assert response.status_code == 302
+    assert response.headers["Location"].startswith("/game/25/")
+
+
+def library(user):
+    return {
+        game_id: (playtime, last_played)
+        for game_id, playtime, last_played in UserGame.select(
+            UserGame.game, UserGame.playtime, UserGame.last_played
+        )
+        .where(UserGame.user == user)
+        .tuples()
+    }
+
+
+def test_upsert_user_games_in_batches(app, monkeypatch):
+    monkeypatch.setattr(sync, "BATCH_SIZE", 2)
+    user = User.create(id=STEAM_ID, username="player", password="x")
+    played = dt.datetime(2022, 1, 1)
+    Game.insert_many([{"id": game_id} for game_id in range(1, 6)]).execute()
+    rows = [
+        {"game": game_id, "playtime": game_id * 10, "last_played": played}
+        for game_id in range(1, 6)
+    ]
+    upsert_user_games(user, rows)
+    assert library(user) == {game_id: (game_id * 10, played) for game_id in range(1, 6)}
+    rows[0]["playtime"] = 1000
+    upsert_user_games(user, rows)
+    assert library(user)[1] == (1000, played)
+    assert len(library(user)) == 5
+
+
+def test_upsert_user_games_reports_changes(app):
+    user = User.create(id=STEAM_ID, username="player", password="x")
+    played, later = dt.datetime(2022, 1, 1), dt.datetime(2022, 2, 1)
+    Game.insert_many([{"id": game_id} for game_id in (1, 2, 3)]).execute()
+    changed = upsert_user_games(
+        user,
+        [
+            {"game": 1, "playtime": 10, "last_played": played},
+            {"game": 2, "playtime": 0, "last_played": None},
+        ],
+    )
+    assert [(row["game"], row["old_playtime"]) for row in changed] == [
+        (1, None),
+        (2, None),
+    ]
+    changed = upsert_user_games(
+        user,
+        [
+            {"game": 1, "playtime": 10, "last_played": played},
+            {"game": 2, "playtime": 0, "last_played": later},
+            {"game": 3, "playtime": 5, "last_played": later},
+        ],
+    )
+    assert changed == [
+        {
+            "game": 2,
+            "playtime": 0,
+            "last_played": later,
+            "old_playtime": 0,
+            "old_last_played": None,
+        },
+        {
+            "game": 3,
+            "playtime": 5,
+            "last_played": later,
+            "old_playtime": None,
+            "old_last_played": None,
+        },
+    ]
+
+
+def test_unchanged_library_keeps_the_recommendations(app, fake_steam):
+    user = User.create(id=STEAM_ID, username="player", password="x")
+    sync_library(user)
+    now = dt.datetime.now()
+    User.update(cbr_update_time=now).where(User.id == user.id).execute()
+    fake_steam.reset_counts()
+    sync_library(user)
+    # the games are fresh and the playtimes the same
+    assert fake_steam.requests["appdetails"] == 0
+    assert User.get_by_id(user.id).cbr_update_time == now